@@ -27,4 +27,16 @@ cd "$recreated_repo_dir"
   --repository-root "$recreated_repo_dir" \
   --request-changes "$INPUT_REQUEST_CHANGES" \
   --suggestions-per-comment "$INPUT_SUGGESTIONS_PER_COMMENT" \
-  --auto-resolve-conversations "$INPUT_AUTO_RESOLVE_CONVERSATIONS"
+  --auto-resolve-conversations "$INPUT_AUTO_RESOLVE_CONVERSATIONS" \
+  --cache-dir "$INPUT_CACHE_DIR" \
+  --stream-reviews "$INPUT_STREAM_REVIEWS" \
+  --diff-base "$INPUT_DIFF_BASE" \
+  --resolve-conversations-since "$INPUT_RESOLVE_CONVERSATIONS_SINCE" \
+  --max-comments "$INPUT_MAX_COMMENTS" \
+  --check-weights "$INPUT_CHECK_WEIGHTS" \
+  --mode "$INPUT_MODE" \
+  --plan-file "$INPUT_PLAN_FILE" \
+  --head-sha "$INPUT_HEAD_SHA" \
+  --metrics-file "$INPUT_METRICS_FILE" \
+  --metrics-summary "$INPUT_METRICS_SUMMARY" \
+  --profile-file "$INPUT_PROFILE_FILE"
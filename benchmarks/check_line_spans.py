@@ -0,0 +1,129 @@
+"""Check that the line spans of the replacements turn the files into the replaced ones
+
+calculate_replacements_line_spans examines only the lines touched by the replacements, and the
+ambiguous changes in a window around them, so it may report other spans than
+diff_replacements_line_spans, which diffs the whole file as the action used to. Both are run
+over every diagnostic of a synthetic corpus. The diagnostics whose calculated spans do not turn
+the file into the one the replacements make are reported, and the exit code is 1 if there are
+any. The number of diagnostics whose spans differ from the diffed ones is printed as well.
+
+Example:
+    python benchmarks/check_line_spans.py --files 200 --diagnostics 20000 --lines-per-file 100
+"""
+
+import argparse
+import importlib
+import os
+import sys
+import tempfile
+
+from corpus import add_corpus_arguments, generate_corpus_from_args
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+run_action = importlib.import_module("run_action")
+
+
+def get_line_spans(function, source_file, replacements):
+    """Returns the spans generated by the function, ending with the error it raises if any"""
+    spans = []
+    try:
+        spans.extend(function(source_file, replacements))
+    except AssertionError as error:
+        spans.append(repr(error))
+
+    return spans
+
+
+def apply_replacements(text, replacements):
+    """Returns the text with the replacements applied, the same way as difflib is given it"""
+    for replacement in sorted(replacements, key=lambda item: -item["Offset"]):
+        text = (
+            text[: replacement["Offset"]]
+            + replacement["ReplacementText"]
+            + text[replacement["Offset"] + replacement["Length"] :]
+        )
+
+    return text
+
+
+def apply_line_spans(text, line_spans):
+    """Returns the text with the sections of the line spans replaced"""
+    lines = run_action.split_lines(text)
+    for start_line_num, end_line_num, replacement_text in reversed(line_spans):
+        lines[start_line_num - 1 : end_line_num] = [replacement_text]
+
+    return "".join(lines)
+
+
+def main():
+    """Entry point"""
+
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    add_corpus_arguments(parser, diagnostic_count=10000)
+    parser.add_argument(
+        "--max-reports",
+        type=int,
+        default=10,
+        help="Number of failing diagnostics to print",
+    )
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as repository_root:
+        corpus = generate_corpus_from_args(repository_root, args)
+        source_files = {
+            os.path.join(repository_root, file_path): run_action.SourceFile(text)
+            for file_path, text in corpus.files.items()
+        }
+
+        diagnostic_count = 0
+        failure_count = 0
+        mismatch_count = 0
+        for diag in corpus.diagnostics:
+            diag_message = diag.get("DiagnosticMessage", diag)
+            if not diag_message["Replacements"]:
+                continue
+
+            diagnostic_count += 1
+            # The replacements of a synthetic diagnostic all concern the same file
+            source_file = source_files[diag_message["Replacements"][0]["FilePath"]]
+            line_spans = get_line_spans(
+                run_action.calculate_replacements_line_spans,
+                source_file,
+                diag_message["Replacements"],
+            )
+            diff_line_spans = get_line_spans(
+                run_action.diff_replacements_line_spans,
+                source_file,
+                diag_message["Replacements"],
+            )
+            if line_spans != diff_line_spans:
+                mismatch_count += 1
+
+            # Both raise on the same replacements, which add text to the end of the file
+            if line_spans and isinstance(line_spans[-1], str):
+                failed = not diff_line_spans or not isinstance(diff_line_spans[-1], str)
+            else:
+                failed = apply_line_spans(
+                    source_file.text, line_spans
+                ) != apply_replacements(source_file.text, diag_message["Replacements"])
+
+            if failed:
+                failure_count += 1
+                if failure_count <= args.max_reports:
+                    print(f"Replacements: {diag_message['Replacements']}")
+                    print(f"    calculated: {line_spans}")
+                    print(f"    diffed:     {diff_line_spans}")
+
+    print(
+        f"{failure_count:d} of {diagnostic_count:d} diagnostic(s) with replacements"
+        " have line spans that do not make the replaced file"
+    )
+    print(
+        f"{mismatch_count:d} of {diagnostic_count:d} diagnostic(s) with replacements"
+        " have other line spans than the whole file diff"
+    )
+    return 1 if failure_count else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,379 @@
+"""Generator of synthetic corpora for the benchmarks: C++ sources, PR patches and fixes YAML
+
+The sources look like ordinary C++ code, the patches are unified diffs with context lines like
+the ones returned by the GitHub API, and the diagnostics cover the replacement shapes produced
+by the Clang-Tidy checks: none at all, renames within a line, insertions and deletions of whole
+lines, multi-line rewrites and multiple replacements per diagnostic. Diagnostics in headers are
+repeated, as they are when many translation units include the same header.
+
+Example:
+    python benchmarks/corpus.py /tmp/corpus --files 200 --diagnostics 10000 --format 9
+"""
+
+import argparse
+import json
+import os
+import random
+import re
+
+import yaml
+
+IDENTIFIERS = [
+    "buffer",
+    "count",
+    "index",
+    "result",
+    "value",
+    "node",
+    "config",
+    "handler",
+    "offset",
+    "length",
+]
+
+CHECK_NAMES = [
+    "readability-identifier-naming",
+    "readability-braces-around-statements",
+    "modernize-use-auto",
+    "modernize-use-nullptr",
+    "performance-unnecessary-value-param",
+    "bugprone-narrowing-conversions",
+    "cppcoreguidelines-pro-type-member-init",
+    "clang-diagnostic-unused-variable",
+]
+
+REPLACEMENT_SHAPES = [
+    "none",
+    "rename",
+    "insert_text",
+    "insert_line",
+    "delete_line",
+    "multi_line",
+    "multi_replacement",
+]
+
+
+class Corpus:  # pylint: disable=too-few-public-methods
+    """Files of a synthetic checkout, the PR files metadata and the diagnostics about them"""
+
+    def __init__(self, repository_root):
+        self.repository_root = repository_root
+        self.files = {}
+        self.pr_files = []
+        self.diagnostics = []
+
+    def write_fixes(self, fixes_path):
+        """Writes the diagnostics to a Clang-Tidy fixes YAML"""
+        with open(fixes_path, "w", encoding="utf_8") as file:
+            yaml.dump(
+                {"MainSourceFile": "", "Diagnostics": self.diagnostics},
+                file,
+                Dumper=getattr(yaml, "CSafeDumper", yaml.SafeDumper),
+            )
+
+
+def generate_source(rng, line_count, header=False):
+    """Returns the text of a C++ source or header with about the given number of lines"""
+    lines = ["// Copyright (c) Synthetic Corp. All rights reserved.\n"]
+    if header:
+        lines.append("#pragma once\n")
+    lines.extend(
+        f"#include <{name}>\n"
+        for name in rng.sample(["map", "memory", "string", "vector"], 2)
+    )
+    lines.append("\n")
+    lines.append(f"namespace synthetic_{rng.randint(0, 9):d} {{\n")
+
+    function_idx = 0
+    while len(lines) < line_count:
+        function_idx += 1
+        lines.append("\n")
+        lines.append(f"// Computes the {rng.choice(IDENTIFIERS)} of the input\n")
+        lines.append(
+            f"int function_{function_idx:d}(const std::vector<int>& input, int"
+            f" {rng.choice(IDENTIFIERS)})\n"
+        )
+        lines.append("{\n")
+        for _ in range(rng.randint(3, 15)):
+            identifier = rng.choice(IDENTIFIERS)
+            statement = rng.choice(
+                [
+                    f"    int {identifier} = input.size() * {rng.randint(1, 99):d};\n",
+                    f"    auto {identifier}_ptr = std::make_unique<int>({identifier});\n",
+                    f"    if ({identifier} > {rng.randint(0, 9):d}) return {identifier};\n",
+                    f"    for (int i = 0; i < {identifier}; ++i) {identifier} += i;\n",
+                    f"    {identifier} = static_cast<int>({identifier} / 2.0);\n",
+                    "\n",
+                ]
+            )
+            lines.append(statement)
+        lines.append("    return 0;\n")
+        lines.append("}\n")
+
+    lines.append("\n")
+    lines.append("}  // namespace\n")
+    return "".join(lines)
+
+
+def generate_patch(rng, text, hunk_count, context=3):  # pylint: disable=too-many-locals
+    """Returns a unified diff patch that results in the given text, like the GitHub API ones
+
+    A few blocks of lines are made up to be added, removed or modified by the PR. As git does,
+    the blocks whose context lines would meet or overlap are put in the same hunk.
+    """
+    lines = text.splitlines(keepends=True)
+    if len(lines) <= 1:
+        return f"@@ -0,0 +1,{len(lines):d} @@\n" + "".join("+" + line for line in lines)
+
+    starts = sorted(rng.sample(range(1, len(lines) + 1), min(hunk_count, len(lines))))
+
+    # Every block holds the new line numbers of its first line and past its last line, and the
+    # number of lines it removes. Blocks are separated by at least one unchanged line.
+    blocks = []
+    for start in starts:
+        if blocks and start <= blocks[-1][1]:
+            continue
+        size = min(rng.randint(1, 8), len(lines) - start + 1)
+        blocks.append((start, start + size, rng.randint(0, 3)))
+
+    hunk_blocks = []
+    for block in blocks:
+        if hunk_blocks and block[0] - hunk_blocks[-1][-1][1] <= 2 * context:
+            hunk_blocks[-1].append(block)
+        else:
+            hunk_blocks.append([block])
+
+    hunks = []
+    old_new_delta = 0
+    for hunk in hunk_blocks:
+        first = max(1, hunk[0][0] - context)
+        stop = min(len(lines) + 1, hunk[-1][1] + context)
+        body = []
+        position = first
+        removed_count = 0
+        for start, block_stop, removed in hunk:
+            body.extend(" " + line for line in lines[position - 1 : start - 1])
+            body.extend(
+                f"-    removed_{rng.randint(0, 99):d}();\n" for _ in range(removed)
+            )
+            body.extend("+" + line for line in lines[start - 1 : block_stop - 1])
+            position = block_stop
+            removed_count += removed
+        body.extend(" " + line for line in lines[position - 1 : stop - 1])
+
+        new_length = stop - first
+        added_count = sum(block_stop - start for start, block_stop, _ in hunk)
+        old_length = new_length - added_count + removed_count
+        hunks.append(
+            f"@@ -{first + old_new_delta:d},{old_length:d}"
+            f" +{first:d},{new_length:d} @@\n" + "".join(body)
+        )
+        old_new_delta += removed_count - added_count
+
+    return "".join(hunks)
+
+
+def generate_replacements(
+    rng, file_path, text, line_offsets, shape
+):  # pylint: disable=too-many-arguments,too-many-positional-arguments,too-many-locals,too-many-return-statements
+    """Returns the offset and the replacements of a diagnostic of the given shape"""
+    # The last line is never touched, so that no text is added to the end of the file
+    line_idx = rng.randrange(len(line_offsets) - 2)
+    start = line_offsets[line_idx]
+    stop = line_offsets[line_idx + 1]
+    line = text[start:stop]
+
+    def replacement(offset, length, replacement_text):
+        return {
+            "FilePath": file_path,
+            "Offset": offset,
+            "Length": length,
+            "ReplacementText": replacement_text,
+        }
+
+    # The first word of the line, or an empty one at the start of a blank line
+    word = re.search(r"\w*", line.lstrip())
+    word_offset = start + len(line) - len(line.lstrip()) + word.start()
+    if shape == "none":
+        return word_offset, []
+    if shape == "rename":
+        return word_offset, [
+            replacement(word_offset, len(word.group()), "renamed_value")
+        ]
+    if shape == "insert_text":
+        return word_offset, [replacement(word_offset, 0, "const ")]
+    if shape == "insert_line":
+        return start, [replacement(start, 0, "    // NOLINTNEXTLINE\n")]
+    if shape == "delete_line":
+        return start, [replacement(start, stop - start, "")]
+    if shape == "multi_line":
+        multi_stop = line_offsets[
+            min(line_idx + rng.randint(2, 4), len(line_offsets) - 2)
+        ]
+        return start, [
+            replacement(
+                start, multi_stop - start, "    {\n        rewritten();\n    }\n"
+            )
+        ]
+
+    # Multiple replacements in nearby lines, e.g. renaming all the uses of a variable
+    replacements = []
+    for nearby_idx in range(line_idx, min(line_idx + 3, len(line_offsets) - 2)):
+        nearby_offset = line_offsets[nearby_idx]
+        replacements.append(replacement(nearby_offset, 0, "/* fixed */ "))
+    return start, replacements
+
+
+def generate_corpus(
+    repository_root,
+    file_count,
+    lines_per_file,
+    diagnostic_count,
+    clang_tidy_format=9,
+    header_ratio=0.2,
+    duplicate_ratio=0.3,
+    shapes=None,
+    seed=0,
+):  # pylint: disable=too-many-arguments,too-many-positional-arguments,too-many-locals
+    """Writes a synthetic checkout to the repository root and returns its Corpus
+
+    A fraction of the files are headers, and a fraction of the diagnostics about headers are
+    duplicated, as if they were reported by more than one translation unit. The diagnostics are
+    in the format of Clang-Tidy 8 or of Clang-Tidy 9 and later, and their replacements have
+    the given shapes, all of REPLACEMENT_SHAPES by default.
+    """
+    rng = random.Random(seed)
+    corpus = Corpus(repository_root)
+
+    for file_idx in range(file_count):
+        header = rng.random() < header_ratio
+        file_path = f"src/module_{file_idx // 50:d}/file_{file_idx:d}" + (
+            ".h" if header else ".cpp"
+        )
+        text = generate_source(
+            rng, rng.randint(lines_per_file // 2, lines_per_file * 3 // 2), header
+        )
+
+        absolute_path = os.path.join(repository_root, file_path)
+        os.makedirs(os.path.dirname(absolute_path), exist_ok=True)
+        with open(absolute_path, "w", encoding="utf_8") as file:
+            file.write(text)
+
+        corpus.files[file_path] = text
+        corpus.pr_files.append(
+            {
+                "filename": file_path,
+                "status": "modified",
+                "patch": generate_patch(rng, text, rng.randint(1, 10)),
+            }
+        )
+
+    line_offsets_per_file = {
+        file_path: [0] + [idx + 1 for idx, char in enumerate(text) if char == "\n"]
+        for file_path, text in corpus.files.items()
+    }
+    file_paths = list(corpus.files)
+
+    while len(corpus.diagnostics) < diagnostic_count:
+        file_path = rng.choice(file_paths)
+        absolute_path = os.path.join(repository_root, file_path)
+        offset, replacements = generate_replacements(
+            rng,
+            absolute_path,
+            corpus.files[file_path],
+            line_offsets_per_file[file_path],
+            rng.choice(shapes or REPLACEMENT_SHAPES),
+        )
+        message = {
+            "Message": f"synthetic issue with '{rng.choice(IDENTIFIERS)}'",
+            "FilePath": absolute_path,
+            "FileOffset": offset,
+            "Replacements": replacements,
+        }
+        diag = {
+            "DiagnosticName": rng.choice(CHECK_NAMES),
+            "Level": rng.choice(["Warning", "Warning", "Warning", "Error", "Remark"]),
+            "BuildDirectory": os.path.join(repository_root, "build"),
+        }
+        if clang_tidy_format >= 9:
+            diag["DiagnosticMessage"] = message
+        else:
+            diag.update(message)
+
+        copies = 1
+        if file_path.endswith(".h") and rng.random() < duplicate_ratio:
+            copies = rng.randint(2, 10)
+        for _ in range(min(copies, diagnostic_count - len(corpus.diagnostics))):
+            corpus.diagnostics.append(json.loads(json.dumps(diag)))
+
+    return corpus
+
+
+def add_corpus_arguments(parser, diagnostic_count=1000):
+    """Adds the arguments that control the size and the format of the corpus to a parser"""
+    parser.add_argument(
+        "--files", type=int, default=100, help="Files changed by the PR"
+    )
+    parser.add_argument(
+        "--lines-per-file", type=int, default=500, help="Average lines of every file"
+    )
+    parser.add_argument(
+        "--diagnostics",
+        type=int,
+        default=diagnostic_count,
+        help="Diagnostics in the fixes YAML",
+    )
+    parser.add_argument(
+        "--format",
+        type=int,
+        choices=(8, 9),
+        default=9,
+        help="Clang-Tidy version whose fixes format is generated (9 stands for 9+)",
+    )
+    parser.add_argument("--seed", type=int, default=0, help="Seed of the generator")
+
+
+def generate_corpus_from_args(repository_root, args, shapes=None):
+    """Generates a corpus as requested by the arguments added by add_corpus_arguments"""
+    return generate_corpus(
+        repository_root,
+        args.files,
+        args.lines_per_file,
+        args.diagnostics,
+        clang_tidy_format=args.format,
+        shapes=shapes,
+        seed=args.seed,
+    )
+
+
+def main():
+    """Entry point"""
+
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("output", type=str, help="Directory to write the corpus to")
+    add_corpus_arguments(parser)
+    parser.add_argument(
+        "--shape",
+        action="append",
+        choices=REPLACEMENT_SHAPES,
+        help="Shape of the replacements of the diagnostics, can be given more than once",
+    )
+    args = parser.parse_args()
+
+    repository_root = os.path.abspath(args.output)
+    corpus = generate_corpus_from_args(repository_root, args, shapes=args.shape)
+    corpus.write_fixes(os.path.join(repository_root, "fixes.yaml"))
+    with open(
+        os.path.join(repository_root, "pr_files.json"), "w", encoding="utf_8"
+    ) as file:
+        json.dump(corpus.pr_files, file)
+
+    print(
+        f"Wrote {len(corpus.files):d} files, their patches and"
+        f" {len(corpus.diagnostics):d} diagnostics to {repository_root}"
+    )
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,360 @@
+"""Local stand-in of the parts of the GitHub REST and GraphQL APIs used by the action
+
+The server keeps the state of a single pull request in memory and serves its files, review
+comments and reviews with the same pagination as GitHub. Latency, server errors and rate limits
+can be injected, so that the behavior of the action under adverse conditions can be measured.
+"""
+
+import collections
+import hashlib
+import http.server
+import json
+import random
+import re
+import threading
+import time
+import urllib.parse
+
+REST_PATH_REGEX = re.compile(
+    r"^/repos/(?P<repo>[^/]+/[^/]+)/pulls/(?P<pull_request_id>\d+)"
+    r"/(?P<endpoint>files|comments|reviews)(?:/(?P<review_id>\d+)/dismissals)?$"
+)
+
+# Matches the paginated connections requested by the GraphQL queries of the action
+GRAPHQL_CONNECTION_REGEX = re.compile(
+    r"(?P<name>reviews|reviewThreads)\(first: (?P<first>\d+), after: (?:null|\"(?P<after>\d+)\")"
+)
+
+GRAPHQL_RESOLVE_REGEX = re.compile(
+    r"(?P<alias>\w+): resolveReviewThread\(input: \{threadId: \"(?P<thread_id>[^\"]+)\""
+)
+
+
+class PullRequestState:  # pylint: disable=too-many-instance-attributes
+    """In-memory state of the pull request served by the stub"""
+
+    def __init__(self, files, comments=None, reviews=None):
+        self.files = files
+        self.comments = list(comments or [])
+        self.reviews = list(reviews or [])
+        self.resolved_threads = set()
+        self.dismissed_reviews = set()
+        self.head_sha = hashlib.sha1(b"head").hexdigest()
+        self.base_sha = hashlib.sha1(b"base").hexdigest()
+        self.lock = threading.Lock()
+
+    def add_review(self, body, event, comments, commit_id=None):
+        """Creates a review along with its comments, each of which starts a thread"""
+        with self.lock:
+            review_id = len(self.reviews) + 1
+            self.reviews.append(
+                {
+                    "id": review_id,
+                    "state": (
+                        "CHANGES_REQUESTED"
+                        if event == "REQUEST_CHANGES"
+                        else "COMMENTED"
+                    ),
+                    "body": body,
+                    "user": {"login": "github-actions[bot]"},
+                    "commit_id": commit_id or self.head_sha,
+                }
+            )
+            for comment in comments:
+                self.comments.append(
+                    dict(
+                        comment,
+                        id=len(self.comments) + 1,
+                        user={"login": "github-actions[bot]"},
+                        created_at="2024-01-01T00:00:00Z",
+                    )
+                )
+
+        return review_id
+
+    def review_threads(self):
+        """Returns the review threads in the format of the GraphQL API"""
+        return [
+            {
+                "id": f"thread-{comment['id']:d}",
+                "isResolved": f"thread-{comment['id']:d}" in self.resolved_threads,
+                "path": comment["path"],
+                "line": comment.get("line"),
+                "diffSide": comment.get("side", "RIGHT"),
+                "comments": {
+                    "nodes": [
+                        {
+                            "body": comment["body"],
+                            "author": {
+                                "login": comment["user"]["login"][: -len("[bot]")]
+                            },
+                            "createdAt": comment["created_at"],
+                        }
+                    ]
+                },
+            }
+            for comment in self.comments
+        ]
+
+
+class FaultInjection:  # pylint: disable=too-few-public-methods,too-many-instance-attributes
+    """Latency, server errors and rate limits injected into the responses of the stub"""
+
+    def __init__(
+        self,
+        latency=0.0,
+        error_rate=0.0,
+        rate_limit=None,
+        rate_limit_window=60.0,
+        seed=0,
+    ):  # pylint: disable=too-many-arguments,too-many-positional-arguments
+        self.latency = latency
+        self.error_rate = error_rate
+        self.rate_limit = rate_limit
+        self.rate_limit_window = rate_limit_window
+        self.random = random.Random(seed)
+        self.window_start = time.time()
+        self.window_requests = 0
+        self.lock = threading.Lock()
+
+    def rate_limit_headers(self):
+        """Counts a request and returns its rate limit headers and whether it is rejected"""
+        if self.rate_limit is None:
+            return {}, False
+
+        with self.lock:
+            now = time.time()
+            if now >= self.window_start + self.rate_limit_window:
+                self.window_start = now
+                self.window_requests = 0
+            self.window_requests += 1
+            remaining = max(self.rate_limit - self.window_requests, 0)
+            reset = self.window_start + self.rate_limit_window
+
+        headers = {
+            "X-RateLimit-Limit": str(self.rate_limit),
+            "X-RateLimit-Remaining": str(remaining),
+            "X-RateLimit-Reset": str(int(reset + 1)),
+        }
+        return headers, self.window_requests > self.rate_limit
+
+    def fail(self):
+        """Returns whether the current request should fail with a server error"""
+        with self.lock:
+            return self.random.random() < self.error_rate
+
+
+class GitHubStubServer(http.server.ThreadingHTTPServer):
+    """HTTP server answering the requests of the action from a PullRequestState
+
+    The number of requests and the bytes sent are counted per endpoint.
+    """
+
+    daemon_threads = True
+
+    def __init__(self, state, faults=None, address=("127.0.0.1", 0)):
+        super().__init__(address, GitHubStubHandler)
+        self.state = state
+        self.faults = faults or FaultInjection()
+        self.request_counts = collections.Counter()
+        self.response_bytes = collections.Counter()
+        self.counters_lock = threading.Lock()
+
+    @property
+    def url(self):
+        """Base URL of the server"""
+        return f"http://{self.server_address[0]}:{self.server_address[1]:d}"
+
+    def start(self):
+        """Serves the requests in a background thread"""
+        thread = threading.Thread(target=self.serve_forever, daemon=True)
+        thread.start()
+        return thread
+
+    def stop(self):
+        """Stops serving the requests and closes the socket"""
+        self.shutdown()
+        self.server_close()
+
+
+class GitHubStubHandler(http.server.BaseHTTPRequestHandler):
+    """Handler of the requests sent to a GitHubStubServer"""
+
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, format, *args):  # pylint: disable=redefined-builtin
+        """Keeps the output of the benchmarks clean"""
+
+    def send_json(self, endpoint, status, payload, headers=None):
+        """Sends a JSON response, with an ETag for successful GET requests"""
+        body = json.dumps(payload).encode("utf-8")
+        headers = dict(headers or {})
+        if self.command == "GET" and status == 200:
+            etag = '"' + hashlib.sha1(body).hexdigest() + '"'
+            headers["ETag"] = etag
+            if self.headers.get("If-None-Match") == etag:
+                status, body = 304, b""
+
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        for name, value in headers.items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+        with self.server.counters_lock:
+            self.server.request_counts[f"{self.command} {endpoint} {status:d}"] += 1
+            self.server.response_bytes[endpoint] += len(body)
+
+    def read_json(self):
+        """Returns the JSON body of the request"""
+        length = int(self.headers.get("Content-Length", 0))
+        return json.loads(self.rfile.read(length) or b"null")
+
+    def handle_request(self, endpoint, respond):
+        """Applies the injected faults, otherwise sends the response built by respond"""
+        faults = self.server.faults
+        if faults.latency:
+            time.sleep(faults.latency)
+
+        headers, rate_limited = faults.rate_limit_headers()
+        if rate_limited:
+            self.send_json(
+                endpoint,
+                403,
+                {"message": "API rate limit exceeded"},
+                headers,
+            )
+        elif faults.fail():
+            self.send_json(endpoint, 502, {"message": "Server Error"}, headers)
+        else:
+            status, payload, extra_headers = respond()
+            headers.update(extra_headers)
+            self.send_json(endpoint, status, payload, headers)
+
+    def paginate(self, path, query, items):
+        """Returns the status, the items of the requested page and the Link header"""
+        per_page = int(query.get("per_page", ["30"])[0])
+        page = int(query.get("page", ["1"])[0])
+        last_page = max(1, -(-len(items) // per_page))
+
+        links = []
+        for rel, rel_page in (("next", page + 1), ("last", last_page)):
+            if page < last_page:
+                links.append(
+                    f"<{self.server.url}{path}?per_page={per_page:d}&page={rel_page:d}>;"
+                    f' rel="{rel}"'
+                )
+
+        headers = {"Link": ", ".join(links)} if links else {}
+        return 200, items[(page - 1) * per_page : page * per_page], headers
+
+    def do_GET(self):  # pylint: disable=invalid-name
+        """Serves the paginated listings of the pull request"""
+        url = urllib.parse.urlparse(self.path)
+        match = REST_PATH_REGEX.match(url.path)
+        if not match or match.group("review_id"):
+            self.send_json("unknown", 404, {"message": "Not Found"})
+            return
+
+        endpoint = match.group("endpoint")
+        state = self.server.state
+        items = {
+            "files": state.files,
+            "comments": state.comments,
+            "reviews": state.reviews,
+        }[endpoint]
+        self.handle_request(
+            endpoint,
+            lambda: self.paginate(url.path, urllib.parse.parse_qs(url.query), items),
+        )
+
+    def do_POST(self):  # pylint: disable=invalid-name
+        """Creates reviews and answers GraphQL queries"""
+        url = urllib.parse.urlparse(self.path)
+        body = self.read_json()
+
+        if url.path == "/graphql":
+            self.handle_request("graphql", lambda: self.graphql(body["query"]))
+            return
+
+        match = REST_PATH_REGEX.match(url.path)
+        if not match or match.group("endpoint") != "reviews":
+            self.send_json("unknown", 404, {"message": "Not Found"})
+            return
+
+        def respond():
+            review_id = self.server.state.add_review(
+                body["body"],
+                body["event"],
+                body.get("comments", []),
+                body.get("commit_id"),
+            )
+            return 200, {"id": review_id}, {}
+
+        self.handle_request("reviews", respond)
+
+    def do_PUT(self):  # pylint: disable=invalid-name
+        """Dismisses reviews"""
+        url = urllib.parse.urlparse(self.path)
+        self.read_json()
+        match = REST_PATH_REGEX.match(url.path)
+        if not match or not match.group("review_id"):
+            self.send_json("unknown", 404, {"message": "Not Found"})
+            return
+
+        def respond():
+            self.server.state.dismissed_reviews.add(int(match.group("review_id")))
+            return 200, {}, {}
+
+        self.handle_request("dismissals", respond)
+
+    def graphql(self, query):
+        """Answers the pull request snapshot queries and the thread resolution mutations"""
+        state = self.server.state
+
+        resolutions = GRAPHQL_RESOLVE_REGEX.findall(query)
+        if resolutions:
+            state.resolved_threads.update(thread_id for _, thread_id in resolutions)
+            return (
+                200,
+                {
+                    "data": {
+                        alias: {"thread": {"id": thread_id}}
+                        for alias, thread_id in resolutions
+                    }
+                },
+                {},
+            )
+
+        pull_request = {"headRefOid": state.head_sha, "baseRefOid": state.base_sha}
+        nodes_per_connection = {
+            "reviews": [
+                {
+                    "databaseId": review["id"],
+                    "state": (
+                        "DISMISSED"
+                        if review["id"] in state.dismissed_reviews
+                        else review["state"]
+                    ),
+                    "body": review["body"],
+                    "author": {"login": review["user"]["login"][: -len("[bot]")]},
+                }
+                for review in state.reviews
+            ],
+            "reviewThreads": state.review_threads(),
+        }
+        for match in GRAPHQL_CONNECTION_REGEX.finditer(query):
+            nodes = nodes_per_connection[match.group("name")]
+            first = int(match.group("first"))
+            after = int(match.group("after") or 0)
+            pull_request[match.group("name")] = {
+                "nodes": nodes[after : after + first],
+                "pageInfo": {
+                    "hasNextPage": after + first < len(nodes),
+                    "endCursor": str(after + first),
+                },
+            }
+
+        return 200, {"data": {"repository": {"pullRequest": pull_request}}}, {}
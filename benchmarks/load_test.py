@@ -0,0 +1,177 @@
+"""End-to-end load test of the action against a local stand-in of the GitHub API
+
+A synthetic pull request with the given number of files and diagnostics is generated, then the
+action is run against the stub server as a separate process, exactly as the launcher runs it.
+The wall time, the number of requests per endpoint and the peak memory of the action are
+reported for every run.
+
+Example:
+    python benchmarks/load_test.py --files 400 --diagnostics 5000 --latency 0.05 --repeat 3
+"""
+
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+from corpus import add_corpus_arguments, generate_corpus_from_args
+from github_stub import FaultInjection, GitHubStubServer, PullRequestState
+
+RUN_ACTION_PATH = os.path.join(
+    os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "run_action.py"
+)
+
+
+def run_action(server, repository_root, fixes_path, extra_args, log_file):
+    """Runs the action against the stub server, returns its wall time, exit code and peak RSS"""
+    env = dict(
+        os.environ,
+        GITHUB_API_URL=server.url,
+        GITHUB_GRAPHQL_URL=server.url + "/graphql",
+        INPUT_GITHUB_TOKEN="stub-token",
+    )
+    command = [
+        sys.executable,
+        RUN_ACTION_PATH,
+        "--clang-tidy-fixes",
+        fixes_path,
+        "--pull-request-id",
+        "1",
+        "--repository",
+        "stub/repository",
+        "--repository-root",
+        repository_root,
+        "--request-changes",
+        "false",
+        "--suggestions-per-comment",
+        "10",
+        "--auto-resolve-conversations",
+        "true",
+        *extra_args,
+    ]
+
+    start = time.perf_counter()
+    with subprocess.Popen(command, env=env, stdout=log_file, stderr=log_file) as action:
+        # The resource usage of the action process alone, not of the earlier runs
+        _, status, resource_usage = os.wait4(action.pid, 0)
+        action.returncode = os.waitstatus_to_exitcode(status)
+    wall_time = time.perf_counter() - start
+
+    # ru_maxrss is measured in KiB on Linux
+    return wall_time, action.returncode, resource_usage.ru_maxrss * 1024
+
+
+def main():  # pylint: disable=too-many-locals
+    """Entry point"""
+
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    add_corpus_arguments(parser)
+    parser.add_argument(
+        "--latency", type=float, default=0.0, help="Delay of every response (seconds)"
+    )
+    parser.add_argument(
+        "--error-rate",
+        type=float,
+        default=0.0,
+        help="Fraction of the requests that fail with a 502 error",
+    )
+    parser.add_argument(
+        "--rate-limit",
+        type=int,
+        default=None,
+        help="Requests allowed per rate limit window, unlimited by default",
+    )
+    parser.add_argument(
+        "--rate-limit-window",
+        type=float,
+        default=10.0,
+        help="Length of the rate limit window (seconds)",
+    )
+    parser.add_argument(
+        "--repeat",
+        type=int,
+        default=1,
+        help="Number of runs, every run after the first one sees the comments of the earlier",
+    )
+    parser.add_argument(
+        "--json",
+        type=str,
+        default="",
+        help="Path of a JSON file to write the results to",
+    )
+    parser.add_argument(
+        "--log",
+        type=str,
+        default=os.devnull,
+        help="Path of a file for the action output",
+    )
+    parser.add_argument(
+        "action_args",
+        nargs=argparse.REMAINDER,
+        help="Extra arguments of run_action.py, after a '--' separator",
+    )
+    args = parser.parse_args()
+    extra_args = [arg for arg in args.action_args if arg != "--"]
+
+    results = []
+    with tempfile.TemporaryDirectory() as repository_root, open(
+        args.log, "w", encoding="utf_8"
+    ) as log_file:
+        corpus = generate_corpus_from_args(repository_root, args)
+        fixes_path = os.path.join(repository_root, "fixes.yaml")
+        corpus.write_fixes(fixes_path)
+        server = GitHubStubServer(
+            PullRequestState(corpus.pr_files),
+            FaultInjection(
+                latency=args.latency,
+                error_rate=args.error_rate,
+                rate_limit=args.rate_limit,
+                rate_limit_window=args.rate_limit_window,
+            ),
+        )
+        server.start()
+
+        try:
+            for run in range(1, args.repeat + 1):
+                server.request_counts.clear()
+                server.response_bytes.clear()
+
+                wall_time, exit_code, peak_rss = run_action(
+                    server, repository_root, fixes_path, extra_args, log_file
+                )
+                results.append(
+                    {
+                        "run": run,
+                        "exit_code": exit_code,
+                        "wall_time": wall_time,
+                        "requests": sum(server.request_counts.values()),
+                        "requests_per_endpoint": dict(server.request_counts),
+                        "response_bytes": sum(server.response_bytes.values()),
+                        "peak_rss": peak_rss,
+                        "posted_comments": len(server.state.comments),
+                    }
+                )
+                print(
+                    f"run {run:d}: exit code {exit_code:d}, {wall_time:.2f} s,"
+                    f" {results[-1]['requests']:d} requests,"
+                    f" {results[-1]['response_bytes'] / 1024:.0f} KiB received,"
+                    f" peak RSS {peak_rss / 1024 / 1024:.1f} MiB,"
+                    f" {results[-1]['posted_comments']:d} comments on the PR"
+                )
+                for endpoint, count in sorted(server.request_counts.items()):
+                    print(f"    {endpoint}: {count:d}")
+        finally:
+            server.stop()
+
+    if args.json:
+        with open(args.json, "w", encoding="utf_8") as file:
+            json.dump(results, file, indent=2)
+
+    return 0 if all(result["exit_code"] == 0 for result in results) else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,239 @@
+"""Micro-benchmarks of the CPU-bound functions of the action over a synthetic corpus
+
+Every benchmark runs a function of run_action.py over the whole corpus, in the same process and
+without any network access. The throughput is the best of the repeated runs, and the memory is
+the peak of the memory allocated during a separate run traced by tracemalloc, divided by the
+number of items processed. Passing --shape runs the suite once per replacement shape, since the
+cost of the comment generation depends heavily on it.
+
+Example:
+    python benchmarks/micro_benchmarks.py --files 200 --diagnostics 20000 --repeat 5
+"""
+
+import argparse
+import contextlib
+import copy
+import importlib
+import json
+import os
+import sys
+import tempfile
+import time
+import tracemalloc
+
+from corpus import (
+    REPLACEMENT_SHAPES,
+    add_corpus_arguments,
+    generate_corpus_from_args,
+)
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+run_action = importlib.import_module("run_action")
+
+SINGLE_COMMENT_MARKERS = {
+    "Error": ":x:",
+    "Warning": ":warning:",
+    "Remark": ":speech_balloon:",
+    "fallback": ":grey_question:",
+}
+
+
+class Benchmark:  # pylint: disable=too-few-public-methods
+    """A function run over the corpus, along with the number and the unit of its items
+
+    The setup function prepares the arguments of every run outside of the measurements, e.g. a
+    copy of the diagnostics that the benchmarked function modifies.
+    """
+
+    def __init__(self, name, unit, item_count, setup, run):
+        self.name = name
+        self.unit = unit
+        self.item_count = item_count
+        self.setup = setup
+        self.run = run
+
+    def measure(self, repeat):
+        """Returns the best wall time among the given number of runs and the peak memory"""
+        best_time = float("inf")
+        for _ in range(repeat):
+            args = self.setup()
+            start = time.perf_counter()
+            self.run(*args)
+            best_time = min(best_time, time.perf_counter() - start)
+
+        args = self.setup()
+        tracemalloc.start()
+        try:
+            self.run(*args)
+            _, peak_memory = tracemalloc.get_traced_memory()
+        finally:
+            tracemalloc.stop()
+
+        return best_time, peak_memory
+
+
+def normalized_diagnostics(corpus, repository_root):
+    """Returns the diagnostics of the corpus upconverted and with paths relative to the root
+
+    This is what generate_review_comments does to the diagnostics before processing them.
+    """
+    diagnostics = copy.deepcopy(corpus.diagnostics)
+    with open(os.devnull, "w", encoding="utf_8") as devnull, contextlib.redirect_stdout(
+        devnull
+    ):
+        for _ in run_action.generate_review_comments(
+            diagnostics, repository_root, {}, SINGLE_COMMENT_MARKERS
+        ):
+            pass
+
+    return diagnostics
+
+
+def create_benchmarks(corpus, fixes_path):
+    """Returns the benchmarks of the functions of the action over the given corpus"""
+    repository_root = corpus.repository_root + "/"
+    diff_line_ranges_per_file = run_action.get_diff_line_ranges_per_file(
+        corpus.pr_files
+    )
+    source_files = {
+        file_path: run_action.SourceFile(text)
+        for file_path, text in corpus.files.items()
+    }
+
+    # The replacements of every diagnostic, grouped by the file they concern
+    replacements_per_file = []
+    for diag in normalized_diagnostics(corpus, repository_root):
+        replacements = diag["DiagnosticMessage"]["Replacements"]
+        for file_path in dict.fromkeys(item["FilePath"] for item in replacements):
+            replacements_per_file.append(
+                (
+                    source_files[file_path],
+                    [item for item in replacements if item["FilePath"] == file_path],
+                )
+            )
+
+    def calculate_all_line_spans():
+        for source_file, replacements in replacements_per_file:
+            for _ in run_action.calculate_replacements_line_spans(
+                source_file, replacements
+            ):
+                pass
+
+    def generate_all_review_comments(diagnostics):
+        with open(
+            os.devnull, "w", encoding="utf_8"
+        ) as devnull, contextlib.redirect_stdout(devnull):
+            for _ in run_action.generate_review_comments(
+                diagnostics,
+                repository_root,
+                diff_line_ranges_per_file,
+                SINGLE_COMMENT_MARKERS,
+                source_files=run_action.SourceFileStore(repository_root),
+            ):
+                pass
+
+    def read_all_diagnostics():
+        for _ in run_action.read_clang_tidy_diagnostics(fixes_path):
+            pass
+
+    diagnostic_count = len(corpus.diagnostics)
+    return [
+        Benchmark(
+            "read_clang_tidy_diagnostics",
+            "diagnostics",
+            diagnostic_count,
+            lambda: (),
+            read_all_diagnostics,
+        ),
+        Benchmark(
+            "get_diff_line_ranges_per_file",
+            "files",
+            len(corpus.pr_files),
+            lambda: (corpus.pr_files,),
+            run_action.get_diff_line_ranges_per_file,
+        ),
+        Benchmark(
+            "reorder_diagnostics",
+            "diagnostics",
+            diagnostic_count,
+            lambda: (corpus.diagnostics,),
+            run_action.reorder_diagnostics,
+        ),
+        Benchmark(
+            "calculate_replacements_line_spans",
+            "diagnostics",
+            len(replacements_per_file),
+            lambda: (),
+            calculate_all_line_spans,
+        ),
+        Benchmark(
+            "generate_review_comments",
+            "diagnostics",
+            diagnostic_count,
+            lambda: (copy.deepcopy(corpus.diagnostics),),
+            generate_all_review_comments,
+        ),
+    ]
+
+
+def main():  # pylint: disable=too-many-locals
+    """Entry point"""
+
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    add_corpus_arguments(parser, diagnostic_count=10000)
+    parser.add_argument(
+        "--shape",
+        action="append",
+        choices=REPLACEMENT_SHAPES,
+        help="Run the suite over diagnostics of only this replacement shape,"
+        " can be given more than once",
+    )
+    parser.add_argument(
+        "--repeat", type=int, default=3, help="Number of timed runs of every benchmark"
+    )
+    parser.add_argument(
+        "--json", type=str, default="", help="Path of a JSON file for the results"
+    )
+    args = parser.parse_args()
+
+    results = []
+    for shape in args.shape or ["all"]:
+        with tempfile.TemporaryDirectory() as repository_root:
+            corpus = generate_corpus_from_args(
+                repository_root, args, shapes=None if shape == "all" else [shape]
+            )
+            fixes_path = os.path.join(repository_root, "fixes.yaml")
+            corpus.write_fixes(fixes_path)
+
+            print(f"Replacement shapes: {shape}")
+            for benchmark in create_benchmarks(corpus, fixes_path):
+                wall_time, peak_memory = benchmark.measure(args.repeat)
+                throughput = benchmark.item_count / wall_time if wall_time else 0.0
+                memory_per_item = peak_memory / max(benchmark.item_count, 1)
+                results.append(
+                    {
+                        "shape": shape,
+                        "benchmark": benchmark.name,
+                        "unit": benchmark.unit,
+                        "items": benchmark.item_count,
+                        "wall_time": wall_time,
+                        "throughput": throughput,
+                        "peak_memory": peak_memory,
+                        "memory_per_item": memory_per_item,
+                    }
+                )
+                print(
+                    f"    {benchmark.name:<36} {benchmark.item_count:>8d} {benchmark.unit:<12}"
+                    f" {wall_time * 1000:>10.1f} ms {throughput:>12.0f} {benchmark.unit}/s"
+                    f" {memory_per_item:>10.0f} B/{benchmark.unit[:-1]}"
+                )
+
+    if args.json:
+        with open(args.json, "w", encoding="utf_8") as file:
+            json.dump(results, file, indent=2)
+
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -2,34 +2,89 @@
 
 """Runner of the 'pull request comments from Clang-Tidy reports' action"""
 
+# pylint: disable=too-many-lines
+
 import argparse
+import bisect
+import collections
+import concurrent.futures
+import contextlib
+import cProfile
+import datetime
 import difflib
+import fnmatch
+import functools
+import glob
+import hashlib
+import itertools
 import json
+import multiprocessing
 import os
 import posixpath
+import random
 import re
+import resource
+import subprocess
 import sys
+import threading
 import time
+import tracemalloc
 import urllib.parse
+import uuid
 
 import requests
 import yaml
 
 
-def get_diff_line_ranges_per_file(pr_files):
-    """Generates and returns a list of line ranges affected by the corresponding patch hunks for
-    each file that has been modified by the processed PR"""
+# Matches hunk headers like '@@ -101,8 +102,11 @@' and captures the '102' and '11' parts
+HUNK_HEADER_REGEX = re.compile(r"^@@ -\d+(?:,\d+)? \+(\d+)(?:,(\d+))? @@", re.MULTILINE)
 
-    def change_to_line_range(change):
-        split_change = change.split(",")
-        start = int(split_change[0])
+# Matches the parts of the GitHub API URL paths that vary between requests to the same endpoint
+API_PATH_REPOSITORY_REGEX = re.compile(r"/repos/[^/]+/[^/]+")
+API_PATH_ID_REGEX = re.compile(r"/\d+(?=/|$)")
 
-        if len(split_change) > 1:
-            size = int(split_change[1])
-        else:
-            size = 1
 
-        return range(start, start + size)
+class ChangedLines:
+    """Sorted and merged ranges of the lines of a file that are covered by the PR diff hunks"""
+
+    def __init__(self):
+        self.starts = []
+        self.stops = []
+
+    def __bool__(self):
+        return bool(self.starts)
+
+    def __iter__(self):
+        return map(range, self.starts, self.stops)
+
+    def add(self, start, stop):
+        """Adds the lines in the [start, stop) range, merging it with overlapping ranges"""
+        if start >= stop:
+            return
+
+        # Only the ranges overlapping with the added one are merged into it. Adjacent ranges
+        # are kept apart, since a comment cannot span two diff hunks even if they touch.
+        first = bisect.bisect_right(self.stops, start)
+        last = bisect.bisect_left(self.starts, stop)
+
+        if first < last:
+            start = min(start, self.starts[first])
+            stop = max(stop, self.stops[last - 1])
+
+        self.starts[first:last] = [start]
+        self.stops[first:last] = [stop]
+
+    def contains(self, start_line_num, end_line_num):
+        """Checks whether all lines from start_line_num to end_line_num (inclusive) are covered
+        by a single range"""
+        idx = bisect.bisect_right(self.starts, start_line_num) - 1
+
+        return idx >= 0 and end_line_num < self.stops[idx]
+
+
+def get_diff_line_ranges_per_file(pr_files):
+    """Generates and returns the line ranges affected by the corresponding patch hunks for
+    each file that has been modified by the processed PR"""
 
     result = {}
 
@@ -39,200 +94,1722 @@ def get_diff_line_ranges_per_file(pr_files):
         if "patch" not in pr_file:
             continue
 
-        file_name = pr_file["filename"]
+        changed_lines = result[pr_file["filename"]] = ChangedLines()
 
-        # The result is something like ['@@ -101,8 +102,11 @@', '@@ -123,9 +127,7 @@']
-        git_line_tags = re.findall(r"^@@ -.*? +.*? @@", pr_file["patch"], re.MULTILINE)
+        for match in HUNK_HEADER_REGEX.finditer(pr_file["patch"]):
+            start = int(match.group(1))
+            # The size of the hunk is omitted if it consists of a single line
+            size = int(match.group(2)) if match.group(2) is not None else 1
 
-        # We need to get it to a state like this: ['102,11', '127,7']
-        changes = [
-            tag.replace("@@", "").strip().split()[1].replace("+", "")
-            for tag in git_line_tags
-        ]
+            changed_lines.add(start, start + size)
+
+    return result
+
+
+def get_diff_line_ranges_from_git(repository_root, diff_base):
+    """Generates and returns the line ranges affected by the hunks of the local git diff
+    between the merge base of diff_base and HEAD, for each file that has been modified
+
+    The diff is parsed while git outputs it. As with the GitHub API, 3 lines of context
+    are included, since they can be commented on as well.
+    """
 
-        result[file_name] = []
-        for line_range in [change_to_line_range(change) for change in changes]:
-            result[file_name].append(line_range)
+    result = {}
+
+    with subprocess.Popen(
+        [
+            "git",
+            "-C",
+            repository_root,
+            # Non-ASCII paths are otherwise quoted and escaped
+            "-c",
+            "core.quotePath=false",
+            "diff",
+            "--unified=3",
+            "--no-color",
+            "--no-ext-diff",
+            "--src-prefix=a/",
+            "--dst-prefix=b/",
+            f"{diff_base}...HEAD",
+            "--",
+        ],
+        stdout=subprocess.PIPE,
+        encoding="utf-8",
+        errors="surrogateescape",
+    ) as git_diff:
+        changed_lines = None
+        in_header = False
+        for line in git_diff.stdout:
+            if line.startswith("diff --git "):
+                changed_lines = None
+                in_header = True
+            elif in_header and line.startswith("+++ "):
+                # Deleted files have no lines that can be commented on
+                # Paths containing spaces are terminated by a tab
+                file_path = line[len("+++ ") :].rstrip("\t\n")
+                if file_path.startswith("b/"):
+                    changed_lines = result[file_path[len("b/") :]] = ChangedLines()
+            elif line.startswith("@@ "):
+                in_header = False
+                match = HUNK_HEADER_REGEX.match(line)
+                if changed_lines is not None and match:
+                    start = int(match.group(1))
+                    # The size of the hunk is omitted if it consists of a single line
+                    size = int(match.group(2)) if match.group(2) is not None else 1
+
+                    changed_lines.add(start, start + size)
+
+    if git_diff.returncode != 0:
+        print(
+            f"::error::git diff against '{diff_base}' failed with exit code"
+            f" {git_diff.returncode:d}"
+        )
+        raise RuntimeError("Failed to compute the diff of the pull request.")
 
     return result
 
 
-def get_pull_request_files(
-    github_api_url, github_token, github_api_timeout, repo, pull_request_id
-):
-    """Generator of GitHub metadata about files modified by the processed PR"""
+def get_head_sha(repository_root):
+    """Returns the SHA of the commit checked out in the repository"""
+    git_rev_parse = subprocess.run(
+        ["git", "-C", repository_root, "rev-parse", "HEAD"],
+        stdout=subprocess.PIPE,
+        encoding="utf-8",
+        check=False,
+    )
+
+    if git_rev_parse.returncode != 0:
+        print(
+            "::error::git rev-parse HEAD failed with exit code"
+            f" {git_rev_parse.returncode:d}"
+        )
+        raise RuntimeError("Failed to find the commit that was analyzed.")
+
+    return git_rev_parse.stdout.strip()
+
+
+class Metrics:  # pylint: disable=too-many-instance-attributes
+    """Instrumentation of a run: the time spent in every phase, the usage of the GitHub API and
+    the memory
+
+    Phases may run concurrently in different threads. The CPU time of a phase is the one of the
+    thread that ran it, plus the one of the worker processes that finished in the meantime. The
+    memory is traced by tracemalloc only if requested, since tracing slows the run down.
+    """
+
+    def __init__(self, trace_memory=False, profile_path=None):
+        self.lock = threading.Lock()
+        self.start_time = time.perf_counter()
+        self.phases = {}
+        self.endpoints = {}
+        self.waits = collections.Counter()
+        self.rate_limits = {}
+        self.profile_path = profile_path
+        self.trace_memory = trace_memory
+
+        if trace_memory:
+            tracemalloc.start()
+
+    @contextlib.contextmanager
+    def phase(self, name, profile=False):
+        """Context manager measuring the wall and the CPU time of a phase of the run
+
+        If the phase is to be profiled and a profile path was given, then the phase runs under
+        cProfile and the statistics are dumped to that path.
+        """
+        profiler = cProfile.Profile() if profile and self.profile_path else None
+
+        start_wall_time = time.perf_counter()
+        start_cpu_time = time.thread_time() + sum(os.times()[2:4])
+        if profiler is not None:
+            profiler.enable()
+
+        try:
+            yield
+        finally:
+            if profiler is not None:
+                profiler.disable()
+                profiler.dump_stats(self.profile_path)
+
+            wall_time = time.perf_counter() - start_wall_time
+            cpu_time = time.thread_time() + sum(os.times()[2:4]) - start_cpu_time
+            with self.lock:
+                phase = self.phases.setdefault(
+                    name, {"count": 0, "wall_time": 0.0, "cpu_time": 0.0}
+                )
+                phase["count"] += 1
+                phase["wall_time"] += wall_time
+                phase["cpu_time"] += cpu_time
+
+    def run_phase(self, name, function, *args, **kwargs):
+        """Calls the given function as a phase of the run and returns its result"""
+        with self.phase(name):
+            return function(*args, **kwargs)
+
+    def record_request(self, method, url, response, elapsed):
+        """Counts a request to the GitHub API, along with the size, the status code and the rate
+        limit information of its response, which is None if the request failed to get one
+        """
+        path = urllib.parse.urlparse(url).path
+        path = API_PATH_ID_REGEX.sub(
+            "/{id}", API_PATH_REPOSITORY_REGEX.sub("/repos/{repo}", path)
+        )
+
+        with self.lock:
+            endpoint = self.endpoints.setdefault(
+                f"{method} {path}",
+                {"requests": 0, "bytes": 0, "wall_time": 0.0, "status_codes": {}},
+            )
+            endpoint["requests"] += 1
+            endpoint["wall_time"] += elapsed
+
+            status = "error"
+            if response is not None:
+                status = str(response.status_code)
+                endpoint["bytes"] += len(response.content)
+
+                resource_name = response.headers.get("X-RateLimit-Resource", "core")
+                remaining = response.headers.get("X-RateLimit-Remaining")
+                if remaining is not None:
+                    rate_limit = {
+                        "limit": int(response.headers.get("X-RateLimit-Limit", 0)),
+                        "remaining": int(remaining),
+                        "reset": int(response.headers.get("X-RateLimit-Reset", 0)),
+                    }
+                    # Responses may arrive out of order, keep the lowest quota of the latest window
+                    previous = self.rate_limits.get(resource_name)
+                    if previous is None or (
+                        rate_limit["reset"],
+                        -rate_limit["remaining"],
+                    ) > (
+                        previous["reset"],
+                        -previous["remaining"],
+                    ):
+                        self.rate_limits[resource_name] = rate_limit
+
+            endpoint["status_codes"][status] = (
+                endpoint["status_codes"].get(status, 0) + 1
+            )
+
+    def record_wait(self, reason, seconds):
+        """Accounts for the time spent sleeping before sending a request"""
+        with self.lock:
+            self.waits[reason] += seconds
+
+    def report(self):
+        """Returns the metrics collected so far as a JSON-serializable dictionary"""
+        # The maximum resident set size is measured in KiB on Linux and in bytes on macOS
+        rss_unit = 1 if sys.platform == "darwin" else 1024
+
+        with self.lock:
+            return {
+                "wall_time": time.perf_counter() - self.start_time,
+                "cpu_time": sum(os.times()[:4]),
+                "phases": json.loads(json.dumps(self.phases)),
+                "http": {
+                    "requests": sum(
+                        endpoint["requests"] for endpoint in self.endpoints.values()
+                    ),
+                    "bytes": sum(
+                        endpoint["bytes"] for endpoint in self.endpoints.values()
+                    ),
+                    "endpoints": json.loads(json.dumps(self.endpoints)),
+                },
+                "waits": dict(self.waits),
+                "rate_limits": dict(self.rate_limits),
+                "memory": {
+                    "tracemalloc_peak": (
+                        tracemalloc.get_traced_memory()[1]
+                        if self.trace_memory
+                        else None
+                    ),
+                    "max_rss": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+                    * rss_unit,
+                    "max_rss_workers": resource.getrusage(
+                        resource.RUSAGE_CHILDREN
+                    ).ru_maxrss
+                    * rss_unit,
+                },
+            }
+
+    def write_json(self, path):
+        """Writes the metrics collected so far to a JSON file"""
+        with open(path, "w", encoding="utf_8") as file:
+            json.dump(self.report(), file, indent=2)
+
+    def write_summary(self, path):
+        """Appends tables of the metrics collected so far to a Markdown file, e.g. the summary
+        of the GitHub Actions job
+        """
+        report = self.report()
+        lines = [
+            "### Clang-Tidy pull request comments",
+            "",
+            "| Phase | Runs | Wall time (s) | CPU time (s) |",
+            "| --- | ---: | ---: | ---: |",
+        ]
+        for name, phase in report["phases"].items():
+            lines.append(
+                f"| {name} | {phase['count']:d} | {phase['wall_time']:.2f}"
+                f" | {phase['cpu_time']:.2f} |"
+            )
+        lines.append(
+            f"| **total** | | {report['wall_time']:.2f} | {report['cpu_time']:.2f} |"
+        )
+
+        lines.extend(
+            [
+                "",
+                "| GitHub API endpoint | Requests | Received (KiB) | Time (s) | Status codes |",
+                "| --- | ---: | ---: | ---: | --- |",
+            ]
+        )
+        for name, endpoint in sorted(report["http"]["endpoints"].items()):
+            status_codes = ", ".join(
+                f"{status}: {count:d}"
+                for status, count in sorted(endpoint["status_codes"].items())
+            )
+            lines.append(
+                f"| `{name}` | {endpoint['requests']:d} | {endpoint['bytes'] / 1024:.1f}"
+                f" | {endpoint['wall_time']:.2f} | {status_codes} |"
+            )
+
+        lines.append("")
+        if report["waits"]:
+            lines.append(
+                "Time spent waiting: "
+                + ", ".join(
+                    f"{reason} {seconds:.1f} s"
+                    for reason, seconds in sorted(report["waits"].items())
+                )
+                + "  "
+            )
+        for resource_name, rate_limit in sorted(report["rate_limits"].items()):
+            lines.append(
+                f"Rate limit ({resource_name}): {rate_limit['remaining']:d} of"
+                f" {rate_limit['limit']:d} requests remaining  "
+            )
+        memory = report["memory"]
+        if memory["tracemalloc_peak"] is not None:
+            lines.append(
+                f"Peak traced memory: {memory['tracemalloc_peak'] / 1024 / 1024:.1f} MiB  "
+            )
+        lines.append(
+            f"Maximum resident set size: {memory['max_rss'] / 1024 / 1024:.1f} MiB"
+            f" (worker processes: {memory['max_rss_workers'] / 1024 / 1024:.1f} MiB)"
+        )
+
+        with open(path, "a", encoding="utf_8") as file:
+            file.write("\n".join(lines) + "\n")
+
+
+class RequestScheduler:
+    """Paces the requests to the GitHub API according to its rate limits
+
+    Requests are sent right away, unless GitHub reports that the rate limit is exhausted or asks
+    to back off. Requests that create content are additionally spaced apart, as recommended in
+    https://docs.github.com/en/rest/using-the-rest-api/best-practices-for-using-the-rest-api
+    """
+
+    # The minimum interval (in seconds) between requests that create or modify content
+    mutation_interval = 1
+    # The wait time (in seconds) after hitting a secondary rate limit without any hints
+    default_backoff = 60
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        # The monotonic times before which no request or no mutating request may be sent
+        self.paused_until = 0
+        self.next_mutation_time = 0
+        self.rate_limit_remaining = None
+
+    def wait(self, mutating):
+        """Blocks until a request, which may create or modify content, is allowed to be sent
+
+        Returns the time (in seconds) it waited and the reason for it.
+        """
+        with self.lock:
+            now = time.monotonic()
+            send_time = max(now, self.paused_until)
+            reason = "rate_limit"
+
+            if mutating:
+                if self.next_mutation_time > send_time:
+                    send_time = self.next_mutation_time
+                    reason = "mutation_interval"
+                self.next_mutation_time = send_time + self.mutation_interval
+
+        if send_time > now:
+            time.sleep(send_time - now)
+
+        return send_time - now, reason
+
+    def update(self, response):
+        """Takes the rate limit information of a response into account
+
+        Returns the time (in seconds) to wait before the request can be retried, if it was
+        rejected due to a rate limit, or None otherwise.
+        """
+        remaining = response.headers.get("X-RateLimit-Remaining")
+        reset = response.headers.get("X-RateLimit-Reset")
+        retry_after = response.headers.get("Retry-After")
+
+        if remaining is not None:
+            self.rate_limit_remaining = int(remaining)
+
+        if retry_after is not None:
+            delay = int(retry_after)
+        elif remaining == "0" and reset is not None:
+            delay = max(int(reset) - time.time(), 0) + 1
+        else:
+            delay = None
+
+        rate_limited = response.status_code == requests.codes.too_many_requests or (
+            response.status_code == requests.codes.forbidden
+            and (delay is not None or "rate limit" in response.text.lower())
+        )  # pylint: disable=no-member
+
+        if rate_limited and delay is None:
+            delay = self.default_backoff
+
+        if delay is not None:
+            with self.lock:
+                self.paused_until = max(self.paused_until, time.monotonic() + delay)
+
+        return delay if rate_limited else None
+
+
+class GitHubClient:  # pylint: disable=too-many-instance-attributes
+    """Client of the GitHub REST and GraphQL APIs
 
-    # Request a maximum of 100 pages (3000 items)
-    for page in range(1, 101):
-        result = requests.get(
-            f"{github_api_url}/repos/{repo}/pulls/{pull_request_id:d}/files?page={page:d}",
-            headers={
+    All requests share a pool of keep-alive connections, the default headers and the timeout.
+    The pool is large enough for the pages of a listing to be fetched concurrently. If an HTTP
+    cache directory is given, the pages of the listings are stored there along with their ETags,
+    so that the later runs only download the pages that have changed. Every request, as well
+    as the time spent waiting before sending it, is recorded in the given Metrics.
+    """
+
+    # The maximum page size allowed by the GitHub REST API
+    per_page = 100
+    # The maximum number of attempts to send a request
+    max_attempts = 5
+    # The initial and the maximum delays (in seconds) before retrying a failed request
+    backoff_base = 2
+    backoff_cap = 60
+    # The status codes of server errors that are likely to be gone on retry
+    transient_status_codes = (500, 502, 503, 504)
+
+    def __init__(
+        self,
+        api_url,
+        graphql_url,
+        token,
+        timeout,
+        max_workers=8,
+        http_cache_dir=None,
+        metrics=None,
+    ):  # pylint: disable=too-many-arguments,too-many-positional-arguments
+        self.api_url = api_url
+        self.graphql_url = graphql_url
+        self.timeout = timeout
+        self.max_workers = max_workers
+
+        self.session = requests.Session()
+        adapter = requests.adapters.HTTPAdapter(
+            pool_connections=max_workers, pool_maxsize=max_workers
+        )
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+        self.session.headers.update(
+            {
                 "Accept": "application/vnd.github.v3+json",
-                "Authorization": f"token {github_token}",
-            },
-            timeout=github_api_timeout,
+                "Authorization": f"token {token}",
+            }
         )
+        self.graphql_headers = {"Authorization": f"Bearer {token}"}
+        self.scheduler = RequestScheduler()
+        self.http_cache_dir = http_cache_dir
+        self.metrics = metrics if metrics is not None else Metrics()
+
+    def request(self, method, url, idempotent=None, mutating=False, **kwargs):
+        """Sends a request to the given URL, which may also be relative to the REST API URL
+
+        Requests rejected due to the rate limits are retried once allowed. Idempotent requests
+        (by default, the ones with idempotent HTTP methods) are also retried after transient
+        server or network errors. Mutating requests, i.e. the ones creating or modifying content,
+        are spaced apart.
+        """
+        if url.startswith("/"):
+            url = self.api_url + url
+
+        if idempotent is None:
+            idempotent = method in ("GET", "HEAD", "PUT", "DELETE")
+
+        kwargs.setdefault("timeout", self.timeout)
+
+        for attempt in range(1, self.max_attempts + 1):
+            waited, reason = self.scheduler.wait(mutating)
+            if waited > 0:
+                self.metrics.record_wait(reason, waited)
+
+            start = time.perf_counter()
+            try:
+                result = self.session.request(method, url, **kwargs)
+            except (
+                requests.exceptions.ConnectionError,
+                requests.exceptions.Timeout,
+            ) as error:
+                self.metrics.record_request(
+                    method, url, None, time.perf_counter() - start
+                )
+                if not idempotent or attempt == self.max_attempts:
+                    raise
+
+                print(f"GitHub API request failed ({error}), retrying...")
+                self.backoff(attempt)
+                continue
+
+            self.metrics.record_request(
+                method, url, result, time.perf_counter() - start
+            )
+
+            delay = self.scheduler.update(result)
+            transient_error = (
+                idempotent and result.status_code in self.transient_status_codes
+            )
+
+            if (delay is None and not transient_error) or attempt == self.max_attempts:
+                break
+
+            if delay is not None:
+                print(
+                    f"GitHub API rate limit reached, retrying in {delay:.0f} seconds..."
+                )
+            else:
+                print(
+                    "GitHub API request failed with status code"
+                    f" {result.status_code:d}, retrying..."
+                )
+                self.backoff(attempt)
+
+        return result
+
+    def backoff(self, attempt):
+        """Waits before retrying a failed request, exponentially longer after every attempt"""
+        delay = min(self.backoff_base * 2 ** (attempt - 1), self.backoff_cap)
+
+        # Randomize the delay, so that concurrent retries are spread out
+        delay = random.uniform(delay / 2, delay)
+        self.metrics.record_wait("retry_backoff", delay)
+        time.sleep(delay)
+
+    def get_page(self, url, page):
+        """Returns the items and the links of the given page of a paginated REST API listing
+
+        If there is a cached copy of the page, then the page is requested only if its ETag has
+        changed. Responses saying that the page has not been modified do not count against the
+        rate limit.
+        """
+        params = {"per_page": self.per_page, "page": page}
+        headers = {}
+
+        cached_page = None
+        if self.http_cache_dir:
+            # The token is not a part of the key, since it changes from run to run
+            cache_path = os.path.join(
+                self.http_cache_dir,
+                hashlib.sha256(
+                    (
+                        (self.api_url + url if url.startswith("/") else url)
+                        + "?"
+                        + urllib.parse.urlencode(params)
+                    ).encode("utf-8")
+                ).hexdigest()
+                + ".json",
+            )
+            try:
+                with open(cache_path, encoding="utf_8") as file:
+                    cached_page = json.load(file)
+                headers["If-None-Match"] = cached_page["etag"]
+            except (OSError, ValueError):
+                cached_page = None
+
+        result = self.request("GET", url, params=params, headers=headers)
+
+        if cached_page is not None and result.status_code == 304:
+            return cached_page["items"], cached_page["links"]
 
         assert result.status_code == requests.codes.ok  # pylint: disable=no-member
 
-        chunk = json.loads(result.text)
+        items = result.json()
+
+        if self.http_cache_dir and "ETag" in result.headers:
+            os.makedirs(self.http_cache_dir, exist_ok=True)
+            # Pages are fetched concurrently, so every thread writes its own temporary file
+            temporary_path = f"{cache_path}.{threading.get_ident():d}.tmp"
+            with open(temporary_path, "w", encoding="utf_8") as file:
+                json.dump(
+                    {
+                        "etag": result.headers["ETag"],
+                        "items": items,
+                        "links": result.links,
+                    },
+                    file,
+                )
+            os.replace(temporary_path, cache_path)
+
+        return items, result.links
+
+    def get_pages(self, url, max_items=3000):
+        """Generator of the items of a paginated REST API listing
+
+        The number of pages is taken from the first one, so that the remaining pages are
+        fetched concurrently. The items are still generated in the order of the pages.
+        """
+        max_pages = max_items // self.per_page
+
+        items, links = self.get_page(url, 1)
+        yield from items
+
+        if "last" in links:
+            last_page_query = urllib.parse.urlparse(links["last"]["url"]).query
+            last_page = min(
+                int(urllib.parse.parse_qs(last_page_query)["page"][0]), max_pages
+            )
+
+            with concurrent.futures.ThreadPoolExecutor(
+                max_workers=self.max_workers
+            ) as executor:
+                for items, _ in executor.map(
+                    functools.partial(self.get_page, url), range(2, last_page + 1)
+                ):
+                    yield from items
+        else:
+            # Without a hint about the last page, follow the pages one by one
+            page = 1
+            while "next" in links and page < max_pages:
+                page += 1
+                items, links = self.get_page(url, page)
+                yield from items
+
+    def graphql(self, query, mutating=False):
+        """Sends a query, or a mutation if mutating is set, to the GraphQL API"""
+        # Both the queries and the mutations sent by the action are safe to repeat
+        return self.request(
+            "POST",
+            self.graphql_url,
+            idempotent=True,
+            mutating=mutating,
+            json={"query": query},
+            headers=self.graphql_headers,
+        )
+
+
+def get_pull_request_files(github_client, repo, pull_request_id):
+    """Generator of GitHub metadata about files modified by the processed PR"""
+
+    # The API returns a maximum of 3000 files
+    yield from github_client.get_pages(f"/repos/{repo}/pulls/{pull_request_id:d}/files")
 
-        if not chunk:
-            break
 
-        yield from chunk
+def review_comment_key(comment):
+    """Compact digest identifying a review comment by its location and body"""
+
+    key = hashlib.blake2b(digest_size=16)
+    for field in ("path", "line", "side", "body"):
+        key.update(str(comment.get(field)).encode("utf-8"))
+        key.update(b"\0")
+    return key.digest()
+
+
+class PullRequestSnapshot:  # pylint: disable=too-few-public-methods
+    """State of the processed PR that is read by the later stages of the action
+
+    The reviews and the review threads, each with its first comment, are downloaded with
+    paginated GraphQL queries that fetch both connections at once.
+    """
+
+    reviews_query = """
+      reviews(first: %d, after: %s) {
+        pageInfo {
+          hasNextPage
+          endCursor
+        }
+        nodes {
+          databaseId
+          state
+          body
+          author {
+            login
+          }
+        }
+      }"""
+
+    review_threads_query = """
+      reviewThreads(first: %d, after: %s) {
+        pageInfo {
+          hasNextPage
+          endCursor
+        }
+        nodes {
+          id
+          isResolved
+          path
+          line
+          diffSide
+          comments(first: 1) {
+            nodes {
+              body
+              author {
+                login
+              }
+              createdAt
+            }
+          }
+        }
+      }"""
+
+    def __init__(self, github_client, repo, pull_request_id):
+        self.head_sha = None
+        self.base_sha = None
+        self.reviews = []
+        self.review_threads = []
+
+        repo_owner, repo_name = repo.split("/")
+        connections = {
+            "reviews": (self.reviews_query, self.reviews),
+            "reviewThreads": (self.review_threads_query, self.review_threads),
+        }
+        cursors = dict.fromkeys(connections)
+        while connections:
+            query = """
+            query {
+              repository(owner: "%s", name: "%s") {
+                pullRequest(number: %d) {
+                  headRefOid
+                  baseRefOid%s
+                }
+              }
+            }
+            """ % (
+                repo_owner,
+                repo_name,
+                pull_request_id,
+                "".join(
+                    connection_query
+                    % (
+                        github_client.per_page,
+                        f'"{cursors[name]}"' if cursors[name] else "null",
+                    )
+                    for name, (connection_query, _) in connections.items()
+                ),
+            )
+
+            response = github_client.graphql(query)
+
+            if response.status_code != 200 or "errors" in response.json():
+                print(f"::error::getting the pull request: {response.status_code}")
+                raise RuntimeError("Failed to get the pull request.")
+
+            pull_request = response.json()["data"]["repository"]["pullRequest"]
+            self.head_sha = pull_request["headRefOid"]
+            self.base_sha = pull_request["baseRefOid"]
+            for name, (_, nodes) in list(connections.items()):
+                nodes.extend(pull_request[name]["nodes"])
+                if pull_request[name]["pageInfo"]["hasNextPage"]:
+                    cursors[name] = pull_request[name]["pageInfo"]["endCursor"]
+                else:
+                    del connections[name]
+
+    def posted_comment_keys(self):
+        """Set of the keys of the comments that start the review threads of the PR"""
+
+        return {
+            review_comment_key(
+                {
+                    "path": thread["path"],
+                    "line": thread["line"],
+                    "side": thread["diffSide"],
+                    "body": comment["body"],
+                }
+            )
+            for thread in self.review_threads
+            for comment in thread["comments"]["nodes"][:1]
+        }
+
+
+def read_clang_tidy_diagnostics(clang_tidy_fixes_path):
+    """Generator of the diagnostics found in the Clang-Tidy fixes YAML
+
+    If PyYAML is built with libyaml, then the document is parsed by the C loader and the
+    diagnostics are constructed one at a time, so that the whole document is never kept in
+    memory. Otherwise, the whole document is loaded at once by the pure Python loader.
+    """
+
+    def compose_node(loader, anchors):
+        # Builds the YAML node that starts with the next parser event, the same way the
+        # composer of PyYAML does
+        event = loader.get_event()
+
+        if isinstance(event, yaml.AliasEvent):
+            return anchors[event.anchor]
+
+        if isinstance(event, yaml.ScalarEvent):
+            tag = event.tag
+            if tag is None or tag == "!":
+                tag = loader.resolve(yaml.ScalarNode, event.value, event.implicit)
+            node = yaml.ScalarNode(
+                tag, event.value, event.start_mark, event.end_mark, style=event.style
+            )
+        elif isinstance(event, yaml.SequenceStartEvent):
+            tag = event.tag
+            if tag is None or tag == "!":
+                tag = loader.resolve(yaml.SequenceNode, None, event.implicit)
+            node = yaml.SequenceNode(
+                tag, [], event.start_mark, None, flow_style=event.flow_style
+            )
+            while not loader.check_event(yaml.SequenceEndEvent):
+                node.value.append(compose_node(loader, anchors))
+            node.end_mark = loader.get_event().end_mark
+        else:
+            assert isinstance(event, yaml.MappingStartEvent)
+
+            tag = event.tag
+            if tag is None or tag == "!":
+                tag = loader.resolve(yaml.MappingNode, None, event.implicit)
+            node = yaml.MappingNode(
+                tag, [], event.start_mark, None, flow_style=event.flow_style
+            )
+            while not loader.check_event(yaml.MappingEndEvent):
+                key_node = compose_node(loader, anchors)
+                node.value.append((key_node, compose_node(loader, anchors)))
+            node.end_mark = loader.get_event().end_mark
+
+        if event.anchor is not None:
+            anchors[event.anchor] = node
+
+        return node
+
+    with open(clang_tidy_fixes_path, encoding="utf_8") as file:
+        if not yaml.__with_libyaml__:
+            clang_tidy_fixes = yaml.safe_load(file)
+
+            if isinstance(clang_tidy_fixes, dict) and clang_tidy_fixes.get(
+                "Diagnostics"
+            ):
+                yield from clang_tidy_fixes["Diagnostics"]
+
+            return
 
+        loader = yaml.CSafeLoader(file)
+        anchors = {}
 
-def get_pull_request_comments(
-    github_api_url, github_token, github_api_timeout, repo, pull_request_id
+        try:
+            loader.get_event()  # Stream start
+
+            # The document is empty, e.g. if no fixes were exported
+            if loader.check_event(yaml.StreamEndEvent):
+                return
+
+            loader.get_event()  # Document start
+
+            if not loader.check_event(yaml.MappingStartEvent):
+                return
+
+            loader.get_event()
+
+            while not loader.check_event(yaml.MappingEndEvent):
+                key = loader.construct_document(compose_node(loader, anchors))
+
+                if key == "Diagnostics" and loader.check_event(yaml.SequenceStartEvent):
+                    loader.get_event()
+                    while not loader.check_event(yaml.SequenceEndEvent):
+                        yield loader.construct_document(compose_node(loader, anchors))
+                    loader.get_event()
+                else:
+                    # Other entries, e.g. 'MainSourceFile', are not needed
+                    compose_node(loader, anchors)
+        finally:
+            loader.dispose()
+
+
+def get_git_blob_sha(file_path):
+    """Returns the git blob SHA-1 of a file, which is also the one listed by the GitHub API"""
+    with open(file_path, "rb") as file:
+        content = file.read()
+
+    return hashlib.sha1(b"blob %d\0" % len(content) + content).hexdigest()
+
+
+class RunCache:
+    """Optional on-disk cache of the results of the previous runs of the action on a PR
+
+    Holds the line ranges changed by the PR for its latest base and head commits and the comments
+    generated for every diagnostic and file content. Only the entries used by the current run are
+    saved, so that the cache does not grow indefinitely. The comments already posted are always
+    looked up in the PR, since they may have been deleted or outdated since.
+    """
+
+    version = 3
+
+    def __init__(self, cache_dir, repo, pull_request_id, repository_root):
+        self.path = os.path.join(
+            cache_dir, f"{repo.replace('/', '_')}-{pull_request_id:d}.json"
+        )
+        self.repository_root = repository_root
+        self.diff_line_ranges = {}
+        self.comments = {}
+        self.used_comments = {}
+        self.blob_shas = {}
+
+        try:
+            with open(self.path, encoding="utf_8") as file:
+                data = json.load(file)
+        except FileNotFoundError:
+            return
+        except ValueError:
+            print(f"Ignoring the corrupted run cache '{self.path}'")
+            return
+
+        if data.get("version") != self.version:
+            return
+
+        self.diff_line_ranges = data["diff_line_ranges"]
+        self.comments = data["comments"]
+
+    def get_diff_line_ranges_per_file(self, key):
+        """Returns the cached line ranges changed by the PR for the given commits, if any"""
+        if key not in self.diff_line_ranges:
+            return None
+
+        result = {}
+        for file_path, ranges in self.diff_line_ranges[key].items():
+            changed_lines = result[file_path] = ChangedLines()
+            for start, stop in ranges:
+                changed_lines.add(start, stop)
+
+        return result
+
+    def set_diff_line_ranges_per_file(self, key, diff_line_ranges_per_file):
+        """Stores the line ranges changed by the PR for the given commits"""
+        self.diff_line_ranges = {
+            key: {
+                file_path: list(zip(changed_lines.starts, changed_lines.stops))
+                for file_path, changed_lines in diff_line_ranges_per_file.items()
+            }
+        }
+
+    def get_blob_sha(self, file_path):
+        """Returns the git blob SHA-1 of a file relative to the repository root"""
+        if file_path not in self.blob_shas:
+            self.blob_shas[file_path] = get_git_blob_sha(
+                self.repository_root + file_path
+            )
+
+        return self.blob_shas[file_path]
+
+    def get_comments_key(self, diag, file_path, single_comment_marker, changed_lines):
+        """Returns the key of the comments of a diagnostic for the current content of a file"""
+        key = hashlib.blake2b(digest_size=16)
+        key.update(
+            json.dumps(
+                [
+                    self.get_blob_sha(file_path),
+                    file_path,
+                    diag,
+                    single_comment_marker,
+                    list(zip(changed_lines.starts, changed_lines.stops)),
+                ],
+                sort_keys=True,
+            ).encode("utf-8")
+        )
+        return key.hexdigest()
+
+    def get_comments(self, key):
+        """Returns the cached comments for the given key, if any"""
+        comments = self.used_comments.get(key, self.comments.get(key))
+        if comments is not None:
+            self.used_comments[key] = comments
+
+        return comments
+
+    def set_comments(self, key, comments):
+        """Stores the comments for the given key"""
+        self.used_comments[key] = comments
+
+    def save(self):
+        """Writes the entries used by the current run to the cache directory"""
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+
+        temporary_path = f"{self.path}.{os.getpid():d}.tmp"
+        with open(temporary_path, "w", encoding="utf_8") as file:
+            json.dump(
+                {
+                    "version": self.version,
+                    "diff_line_ranges": self.diff_line_ranges,
+                    "comments": self.used_comments,
+                },
+                file,
+            )
+        os.replace(temporary_path, self.path)
+
+
+def find_clang_tidy_fixes_files(clang_tidy_fixes):
+    """Returns the sorted paths of the fixes files given as a file, a directory or a glob"""
+
+    if os.path.isfile(clang_tidy_fixes):
+        return [clang_tidy_fixes]
+
+    if os.path.isdir(clang_tidy_fixes):
+        paths = glob.glob(
+            os.path.join(glob.escape(clang_tidy_fixes), "**", "*.yaml"), recursive=True
+        ) + glob.glob(
+            os.path.join(glob.escape(clang_tidy_fixes), "**", "*.yml"), recursive=True
+        )
+    else:
+        paths = glob.glob(clang_tidy_fixes, recursive=True)
+
+    return sorted(path for path in paths if os.path.isfile(path))
+
+
+def read_clang_tidy_fixes_file(clang_tidy_fixes_path, file_paths, repository_root):
+    """Reads the unique diagnostics of a fixes file that refer to any of the given files
+
+    Runs in a worker process. Returns the number of diagnostics in the file, the kept ones and
+    the log messages, so that the caller can print them in order.
+    """
+    diag_count = 0
+    messages = []
+
+    def count_diagnostics(diags):
+        nonlocal diag_count
+        for diag in diags:
+            diag_count += 1
+            yield diag
+
+    diags = list(
+        deduplicate_diagnostics(
+            filter_diagnostics_by_files(
+                count_diagnostics(read_clang_tidy_diagnostics(clang_tidy_fixes_path)),
+                file_paths,
+                repository_root,
+                log=messages.append,
+            ),
+            repository_root,
+            log=messages.append,
+        )
+    )
+
+    return diag_count, diags, messages
+
+
+def read_clang_tidy_fixes_files(
+    clang_tidy_fixes_paths, file_paths, repository_root, jobs=1
 ):
-    """Generator of GitHub metadata about comments to the processed PR"""
+    """Reads and merges the diagnostics of many fixes files that refer to any of the given files
 
-    # Request a maximum of 100 pages (3000 items)
-    for page in range(1, 101):
-        result = requests.get(
-            f"{github_api_url}/repos/{repo}/pulls/{pull_request_id:d}/comments?page={page:d}",
-            headers={
-                "Accept": "application/vnd.github.v3+json",
-                "Authorization": f"token {github_token}",
-            },
-            timeout=github_api_timeout,
+    The files are parsed and filtered in a process pool, if more than one job is allowed.
+    Returns the total number of diagnostics in the files and the kept ones, in the order of the
+    files. The diagnostics found in more than one file are not removed yet.
+    """
+    diag_count = 0
+    diags = []
+
+    executor = None
+    if jobs > 1:
+        executor = concurrent.futures.ProcessPoolExecutor(
+            max_workers=min(jobs, len(clang_tidy_fixes_paths)),
+            # Forking a process that runs the HTTP threads is unsafe
+            mp_context=multiprocessing.get_context("spawn"),
         )
 
-        assert result.status_code == requests.codes.ok  # pylint: disable=no-member
+    try:
+        results = (executor.map if executor else map)(
+            read_clang_tidy_fixes_file,
+            clang_tidy_fixes_paths,
+            itertools.repeat(file_paths),
+            itertools.repeat(repository_root),
+        )
+        for clang_tidy_fixes_path, (file_diag_count, file_diags, messages) in zip(
+            clang_tidy_fixes_paths, results
+        ):
+            for message in messages:
+                print(f"{clang_tidy_fixes_path}: {message}")
+            diag_count += file_diag_count
+            diags.extend(file_diags)
+    finally:
+        if executor:
+            executor.shutdown()
+
+    print(
+        f"Read {diag_count:d} diagnostic(s) from"
+        f" {len(clang_tidy_fixes_paths):d} clang-tidy fixes files"
+    )
 
-        chunk = json.loads(result.text)
+    return diag_count, diags
 
-        if not chunk:
-            break
 
-        yield from chunk
+def split_lines(text):
+    """Splits a text into lines at newline characters only, the same way SourceFile does"""
+    lines = text.split("\n")
+    last_line = lines.pop()
 
+    return [line + "\n" for line in lines] + ([last_line] if last_line else [])
 
-def generate_review_comments(
-    clang_tidy_fixes, repository_root, diff_line_ranges_per_file, single_comment_markers
-):  # pylint: disable=too-many-locals,too-many-branches,too-many-statements
-    """Generator of the Clang-Tidy review comments"""
 
-    def get_line_by_offset(repository_root, file_path, offset):
-        # Clang-Tidy doesn't support multibyte encodings and measures offsets in bytes
-        with open(repository_root + file_path, encoding="latin_1") as file:
-            source_file = file.read()
+class SourceFile:
+    """Contents of a source file along with the offsets at which each of its lines starts"""
 
-        return source_file[:offset].count("\n") + 1
+    def __init__(self, text):
+        self.text = text
+        # The first line starts at the beginning of the file, every other line starts right
+        # after a newline character
+        self.line_offsets = [0]
+        self.line_offsets.extend(match.end() for match in re.finditer("\n", text))
+        self.line_count = len(self.line_offsets) - (self.line_offsets[-1] == len(text))
+        self.line_indexes = None
 
-    def validate_warning_applicability(
-        diff_line_ranges_per_file, file_path, start_line_num, end_line_num
-    ):
-        assert end_line_num >= start_line_num
+    def get_line_by_offset(self, offset):
+        """Returns the (1-based) number of the line that contains the given offset"""
+        return bisect.bisect_right(self.line_offsets, offset)
 
-        for line_range in diff_line_ranges_per_file[file_path]:
-            assert line_range.step == 1
+    def get_lines_text(self, first_line_idx, last_line_idx):
+        """Returns the text of the lines between the given (0-based) indexes, inclusive"""
+        start = self.line_offsets[first_line_idx]
+        if last_line_idx + 1 < len(self.line_offsets):
+            return self.text[start : self.line_offsets[last_line_idx + 1]]
 
-            if line_range.start <= start_line_num and end_line_num < line_range.stop:
-                return True
+        return self.text[start:]
 
-        return False
+    def get_line_indexes(self, line):
+        """Returns the (0-based) indexes of the lines of the file identical to the given one"""
+        if self.line_indexes is None:
+            self.line_indexes = collections.defaultdict(list)
+            for line_idx, file_line in enumerate(split_lines(self.text)):
+                self.line_indexes[file_line].append(line_idx)
+
+        return self.line_indexes.get(line, [])
+
+    def count_line(self, line):
+        """Returns how many lines of the file are identical to the given one"""
+        return len(self.get_line_indexes(line))
+
+    def size(self):
+        """Returns the approximate amount of memory (in bytes) occupied by the file"""
+        # The offset index is accounted as a machine word per line, and the line index built on
+        # demand as another copy of the text and a machine word per line
+        return 2 * len(self.text) + 16 * len(self.line_offsets)
+
+
+class SourceFileStore:  # pylint: disable=too-few-public-methods
+    """Per-run store of the source files referenced by the Clang-Tidy diagnostics
+
+    Every file is read only once and kept along with its line offsets index. The least recently
+    used files are evicted once the total size of the stored files exceeds the given limit.
+    """
 
-    def calculate_replacements_diff(repository_root, file_path, replacements):
-        # Apply the replacements in reverse order so that subsequent offsets are not shifted
-        replacements.sort(key=lambda item: (-item["Offset"]))
+    def __init__(self, repository_root, max_size=256 * 1024 * 1024):
+        self.repository_root = repository_root
+        self.max_size = max_size
+        self.files = collections.OrderedDict()
+        self.total_size = 0
+
+    def get(self, file_path):
+        """Returns the SourceFile corresponding to the given path relative to the repository"""
+        if file_path in self.files:
+            self.files.move_to_end(file_path)
+            return self.files[file_path]
 
         # Clang-Tidy doesn't support multibyte encodings and measures offsets in bytes
-        with open(repository_root + file_path, encoding="latin_1") as file:
-            source_file = file.read()
+        with open(self.repository_root + file_path, encoding="latin_1") as file:
+            source_file = SourceFile(file.read())
 
-        changed_file = source_file
+        self.files[file_path] = source_file
+        self.total_size += source_file.size()
+
+        # Always keep at least the most recently requested file
+        while self.total_size > self.max_size and len(self.files) > 1:
+            _, evicted_file = self.files.popitem(last=False)
+            self.total_size -= evicted_file.size()
+
+        return source_file
 
-        for replacement in replacements:
-            changed_file = (
-                changed_file[: replacement["Offset"]]
-                + replacement["ReplacementText"]
-                + changed_file[replacement["Offset"] + replacement["Length"] :]
-            )
 
-        # Create and return the diff between the original version of the file and the version
-        # with the applied replacements
-        return difflib.Differ().compare(
-            source_file.splitlines(keepends=True),
-            changed_file.splitlines(keepends=True),
+def diff_replacements_line_spans(source_file, replacements):
+    """Generator of the line spans of a source file that are changed by the given replacements
+
+    The replacements are applied to the whole file and the spans are the sections that differ
+    between its original and its changed version, as found by difflib.Differ.
+    """
+    # Apply the replacements in reverse order so that subsequent offsets are not shifted
+    changed_text = source_file.text
+    for replacement in sorted(replacements, key=lambda item: -item["Offset"]):
+        changed_text = (
+            changed_text[: replacement["Offset"]]
+            + replacement["ReplacementText"]
+            + changed_text[replacement["Offset"] + replacement["Length"] :]
         )
 
-    def markdown(s):
-        md_chars = "\\`*_{}[]<>()#+-.!|"
+    yield from diff_line_spans(split_lines(source_file.text), split_lines(changed_text))
+
+
+def diff_line_spans(original_lines, changed_lines, line_num=1):
+    """Generator of the line spans that differ between the original and the changed lines
 
-        def escape_chars(s):
-            for ch in md_chars:
-                s = s.replace(ch, "\\" + ch)
+    The spans are the ones found by difflib.Differ, numbered from the given line number.
+    """
+    start_line_num = None
+    end_line_num = None
+    replacement_text = None
+
+    for line in difflib.Differ().compare(original_lines, changed_lines):
+        # The comment line in the diff, ignore it
+        if line.startswith("? "):
+            continue
+
+        # A string belonging only to the original version is the beginning or continuation of
+        # the section of the file that should be replaced
+        if line.startswith("- "):
+            if start_line_num is None:
+                start_line_num = line_num
+            end_line_num = line_num
+
+            if replacement_text is None:
+                replacement_text = ""
+
+            line_num += 1
+        # A string belonging only to the modified version is part of the replacement text
+        elif line.startswith("+ "):
+            replacement_text = (replacement_text or "") + line[2:]
+        # A string belonging to both original and modified versions is the end of the section
+        # to replace
+        else:
+            if replacement_text is not None:
+                # If there is no section to replace, then this is a pure addition of text. Add
+                # the current line to the end of the replacement text and "replace" it instead.
+                if start_line_num is None:
+                    start_line_num = line_num
+                    end_line_num = line_num
+                    replacement_text += line[2:]
+
+                yield start_line_num, end_line_num, replacement_text
+
+                start_line_num = None
+                end_line_num = None
+                replacement_text = None
+
+            line_num += 1
+
+    # The end of the file is reached, but there is a section to replace
+    if replacement_text is not None:
+        # Pure addition of text to the end of the file is not currently supported. If you have
+        # an example of a Clang-Tidy replacement of this kind, please contact the repository
+        # maintainer.
+        assert (
+            start_line_num is not None
+        ), "Please report this to the repository maintainer"
 
-            return s
+        yield start_line_num, end_line_num, replacement_text
 
-        def unescape_chars(s):
-            for ch in md_chars:
-                s = s.replace("\\" + ch, ch)
 
-            return s
+def find_ambiguous_changes(source_file, changes):
+    """Returns the indexes of the changes of a source file that difflib.Differ may report otherwise
 
-        # Escape markdown characters
-        s = escape_chars(s)
-        # Decorate quoted symbols as code
-        s = re.sub(
-            "'([^']*)'", lambda match: "`` " + unescape_chars(match.group(1)) + " ``", s
+    Every change is a tuple of the (0-based) index of the first line it replaces, the lines it
+    removes and the lines it adds. Differ aligns the lines of the whole file, so it may match
+    the lines of a change, or the lines around it, to identical lines elsewhere and report
+    another span. In files of 200 lines or more, it also ignores the most common lines when
+    looking for matches. None of this can happen if the removed lines are unique in the file,
+    the added lines are new to it, the lines joined by a pure addition or removal are not found
+    next to each other elsewhere and an uncommon line separates the change from the next one.
+    """
+
+    def get_line(line_idx):
+        return source_file.get_lines_text(line_idx, line_idx)
+
+    changed_line_count = source_file.line_count + sum(
+        len(added_lines) - len(removed_lines)
+        for _, removed_lines, added_lines in changes
+    )
+    max_line_count = (
+        changed_line_count // 100 + 1 if changed_line_count >= 200 else float("inf")
+    )
+
+    ambiguous_change_idxs = set()
+    for change_idx, (start_line_idx, removed_lines, added_lines) in enumerate(changes):
+        stop_line_idx = start_line_idx + len(removed_lines)
+        next_start_line_idx = (
+            changes[change_idx + 1][0]
+            if change_idx + 1 < len(changes)
+            else source_file.line_count
         )
 
-        return s
+        # Changes with no line left unchanged between them are reported as a single span
+        if change_idx + 1 < len(changes) and next_start_line_idx <= stop_line_idx:
+            ambiguous_change_idxs.update((change_idx, change_idx + 1))
+
+        # Differ may match the common lines that separate changes elsewhere
+        if stop_line_idx < next_start_line_idx and all(
+            source_file.count_line(get_line(line_idx)) > max_line_count
+            for line_idx in range(stop_line_idx, next_start_line_idx)
+        ):
+            ambiguous_change_idxs.update((change_idx, change_idx + 1))
+
+        if any(source_file.count_line(line) != 1 for line in removed_lines) or any(
+            source_file.count_line(line) for line in added_lines
+        ):
+            ambiguous_change_idxs.add(change_idx)
+        elif (
+            (not removed_lines or not added_lines)
+            and start_line_idx > 0
+            and stop_line_idx < source_file.line_count
+        ):
+            previous_line = get_line(start_line_idx - 1)
+            next_line = get_line(stop_line_idx)
+            if (
+                source_file.count_line(previous_line) <= max_line_count
+                and source_file.count_line(next_line) <= max_line_count
+            ):
+                # A pure addition splits the pair of lines, a pure removal joins them
+                pair_count = sum(
+                    1
+                    for line_idx in source_file.get_line_indexes(previous_line)
+                    if line_idx + 1 < source_file.line_count
+                    and get_line(line_idx + 1) == next_line
+                )
+                if pair_count != (1 if added_lines else 0):
+                    ambiguous_change_idxs.add(change_idx)
 
-    def markdown_url(label, url):
-        return f"[{label}]({url})"
+    ambiguous_change_idxs.discard(len(changes))
+    return ambiguous_change_idxs
 
-    def diagnostic_name_visual(diagnostic_name):
-        visual = f"**{markdown(diagnostic_name)}**"
 
-        try:
-            first_dash_idx = diagnostic_name.index("-")
-        except ValueError:
-            return visual
+def is_in_window(window, line_idx, line_count):
+    """Returns whether a change that starts at the given (0-based) line index is in a window"""
+    # A pure addition to the end of the file starts past the last line
+    return window[0] <= line_idx < window[1] or line_idx == window[1] == line_count
 
-        namespace = urllib.parse.quote_plus(diagnostic_name[:first_dash_idx])
-        check_name = urllib.parse.quote_plus(diagnostic_name[first_dash_idx + 1 :])
-        return markdown_url(
-            visual,
-            f"https://clang.llvm.org/extra/clang-tidy/checks/{namespace}/{check_name}.html",
+
+def find_diff_windows(source_file, changes, ambiguous_change_idxs):
+    """Returns the windows of lines of a source file in which its ambiguous changes are diffed
+
+    Every window is a pair of the (0-based) indexes of its first line and of the line past its
+    end, and holds the changes that start in it. It stretches from an ambiguous change to the
+    nearest lines before and after it that are left unchanged, unique in the file and not
+    added by any change. Since such an anchor line can only be matched to itself, the lines on
+    either side of it are aligned independently, and Differ is run only between two anchors.
+    """
+    added_lines = {line for _, _, lines in changes for line in lines}
+    changed_line_idxs = set()
+    for start_line_idx, removed_lines, _ in changes:
+        # The line that follows a pure addition is a part of its span
+        changed_line_idxs.update(
+            range(start_line_idx, start_line_idx + max(len(removed_lines), 1))
+        )
+
+    def is_anchor(line_idx):
+        line = source_file.get_lines_text(line_idx, line_idx)
+        return (
+            line_idx not in changed_line_idxs
+            and line not in added_lines
+            and source_file.count_line(line) == 1
         )
 
-    def generate_single_comment(
-        file_path,
+    windows = []
+    for change_idx in sorted(ambiguous_change_idxs):
+        start_line_idx, removed_lines, _ = changes[change_idx]
+        if windows and is_in_window(
+            windows[-1], start_line_idx, source_file.line_count
+        ):
+            continue
+
+        first_line_idx = start_line_idx - 1
+        while first_line_idx > 0 and not is_anchor(first_line_idx):
+            first_line_idx -= 1
+        stop_line_idx = start_line_idx + len(removed_lines)
+        while stop_line_idx < source_file.line_count and not is_anchor(stop_line_idx):
+            stop_line_idx += 1
+
+        window = [
+            max(first_line_idx, 0),
+            min(stop_line_idx + 1, source_file.line_count),
+        ]
+        if windows and window[0] < windows[-1][1]:
+            windows[-1][1] = window[1]
+        else:
+            windows.append(window)
+
+    return windows
+
+
+def diff_window_line_spans(source_file, window, changes):
+    """Generator of the line spans changed in a window of a source file, see find_diff_windows"""
+    first_line_idx, stop_line_idx = window
+    original_lines = split_lines(
+        source_file.get_lines_text(first_line_idx, stop_line_idx - 1)
+    )
+
+    changed_lines = list(original_lines)
+    # Apply the changes in reverse order so that the indexes of the previous ones still hold
+    for start_line_idx, removed_lines, added_lines in reversed(list(changes)):
+        start_line_idx -= first_line_idx
+        changed_lines[
+            start_line_idx : start_line_idx + len(removed_lines)
+        ] = added_lines
+
+    yield from diff_line_spans(original_lines, changed_lines, first_line_idx + 1)
+
+
+def calculate_replacements_line_spans(
+    source_file, replacements
+):  # pylint: disable=too-many-locals,too-many-branches
+    """Generator of the line spans of a source file that are changed by the given replacements
+
+    Every span is a tuple of the first and the last (1-based) line numbers of the section of the
+    file to replace and the text to replace it with. Only the lines touched by the replacements
+    are examined, so the cost does not depend on the size of the file. The spans are the ones
+    found by diff_replacements_line_spans, except for the changes that difflib could align
+    differently in the whole file (see find_ambiguous_changes). Those are diffed only in a
+    window between the nearest unique unchanged lines around them (see find_diff_windows), so
+    their lines are never matched to identical lines beyond it. Overlapping replacements are
+    still diffed over the whole file.
+    """
+    # Replacements at the same offset are applied so that the ones given last end up first
+    ordered_replacements = [
+        replacement
+        for _, replacement in sorted(
+            enumerate(replacements),
+            key=lambda item: (item[1]["Offset"], -item[0]),
+        )
+    ]
+
+    # Group the replacements that touch the same or adjacent lines, since a single suggestion
+    # has to cover all of them. The groups hold 0-based indexes of their first and last lines.
+    groups = []
+    previous_end = 0
+    for replacement in ordered_replacements:
+        # Overlapping replacements are applied one over another by Differ
+        if replacement["Offset"] < previous_end:
+            yield from diff_replacements_line_spans(source_file, replacements)
+            return
+        previous_end = replacement["Offset"] + replacement["Length"]
+
+        first_line_idx = source_file.get_line_by_offset(replacement["Offset"]) - 1
+        # A replacement that ends right after a newline character does not touch the next line,
+        # unless the newline is removed
+        last_line_idx = (
+            source_file.get_line_by_offset(max(replacement["Offset"], previous_end - 1))
+            - 1
+        )
+
+        if groups and first_line_idx <= groups[-1][1] + 1:
+            groups[-1][1] = max(groups[-1][1], last_line_idx)
+            groups[-1][2].append(replacement)
+        else:
+            groups.append([first_line_idx, last_line_idx, [replacement]])
+
+    # The changes hold the (0-based) index of the first line they replace, the lines removed
+    # and the lines added in their place
+    changes = []
+    for first_line_idx, last_line_idx, group_replacements in groups:
+        original_text = source_file.get_lines_text(first_line_idx, last_line_idx)
+        group_offset = source_file.line_offsets[first_line_idx]
+
+        changed_text = ""
+        position = 0
+        for replacement in group_replacements:
+            offset = replacement["Offset"] - group_offset
+            changed_text += original_text[position:offset]
+            changed_text += replacement["ReplacementText"]
+            position = offset + replacement["Length"]
+        changed_text += original_text[position:]
+
+        # A replacement that removes the last newline of the group joins the line that follows
+        if (
+            changed_text
+            and not changed_text.endswith("\n")
+            and last_line_idx + 1 < source_file.line_count
+        ):
+            next_line_text = source_file.get_lines_text(
+                last_line_idx + 1, last_line_idx + 1
+            )
+            original_text += next_line_text
+            changed_text += next_line_text
+
+        original_lines = split_lines(original_text)
+        changed_lines = split_lines(changed_text)
+
+        # Lines that stay the same at either end of the group are not part of the suggestion
+        prefix_length = 0
+        while (
+            prefix_length < min(len(original_lines), len(changed_lines))
+            and original_lines[prefix_length] == changed_lines[prefix_length]
+        ):
+            prefix_length += 1
+        suffix_length = 0
+        while (
+            suffix_length < min(len(original_lines), len(changed_lines)) - prefix_length
+            and original_lines[-1 - suffix_length] == changed_lines[-1 - suffix_length]
+        ):
+            suffix_length += 1
+
+        if prefix_length + suffix_length < max(len(original_lines), len(changed_lines)):
+            changes.append(
+                (
+                    first_line_idx + prefix_length,
+                    original_lines[prefix_length : len(original_lines) - suffix_length],
+                    changed_lines[prefix_length : len(changed_lines) - suffix_length],
+                )
+            )
+
+    # The ambiguous changes are diffed in windows, along with the other changes in the same ones
+    windows = find_diff_windows(
+        source_file, changes, find_ambiguous_changes(source_file, changes)
+    )
+    window_first_line_idxs = [first_line_idx for first_line_idx, _ in windows]
+
+    def get_window_idx(change):
+        window_idx = bisect.bisect_right(window_first_line_idxs, change[0]) - 1
+        if window_idx >= 0 and is_in_window(
+            windows[window_idx], change[0], source_file.line_count
+        ):
+            return window_idx
+        return None
+
+    for window_idx, window_changes in itertools.groupby(changes, key=get_window_idx):
+        if window_idx is not None:
+            yield from diff_window_line_spans(
+                source_file, windows[window_idx], window_changes
+            )
+            continue
+
+        for start_line_idx, removed_lines, added_lines in window_changes:
+            if removed_lines:
+                yield (
+                    start_line_idx + 1,
+                    start_line_idx + len(removed_lines),
+                    "".join(added_lines),
+                )
+                continue
+
+            # If there is no section to replace, then this is a pure addition of text. Add the
+            # line that follows to the end of the replacement text and "replace" it instead.
+
+            # Pure addition of text to the end of the file is not currently supported. If you have
+            # an example of a Clang-Tidy replacement of this kind, please contact the repository
+            # maintainer.
+            assert (
+                start_line_idx < source_file.line_count
+            ), "Please report this to the repository maintainer"
+
+            yield (
+                start_line_idx + 1,
+                start_line_idx + 1,
+                "".join(added_lines)
+                + source_file.get_lines_text(start_line_idx, start_line_idx),
+            )
+
+
+@functools.lru_cache(maxsize=None)
+def normalize_path(file_path, repository_root):
+    """Returns the path of a file relative to the repository root"""
+    return posixpath.normpath(file_path.replace(repository_root, ""))
+
+
+def markdown(s):
+    """Escapes the markdown characters of a Clang-Tidy message and decorates quoted symbols"""
+    md_chars = "\\`*_{}[]<>()#+-.!|"
+
+    def escape_chars(s):
+        for ch in md_chars:
+            s = s.replace(ch, "\\" + ch)
+
+        return s
+
+    def unescape_chars(s):
+        for ch in md_chars:
+            s = s.replace("\\" + ch, ch)
+
+        return s
+
+    # Escape markdown characters
+    s = escape_chars(s)
+    # Decorate quoted symbols as code
+    s = re.sub(
+        "'([^']*)'", lambda match: "`` " + unescape_chars(match.group(1)) + " ``", s
+    )
+
+    return s
+
+
+def markdown_url(label, url):
+    """Returns a markdown link"""
+    return f"[{label}]({url})"
+
+
+def diagnostic_name_visual(diagnostic_name):
+    """Returns the name of a diagnostic in bold, linked to its documentation if possible"""
+    visual = f"**{markdown(diagnostic_name)}**"
+
+    try:
+        first_dash_idx = diagnostic_name.index("-")
+    except ValueError:
+        return visual
+
+    namespace = urllib.parse.quote_plus(diagnostic_name[:first_dash_idx])
+    check_name = urllib.parse.quote_plus(diagnostic_name[first_dash_idx + 1 :])
+    return markdown_url(
+        visual,
+        f"https://clang.llvm.org/extra/clang-tidy/checks/{namespace}/{check_name}.html",
+    )
+
+
+def generate_single_comment(
+    file_path,
+    start_line_num,
+    end_line_num,
+    name,
+    message,
+    single_comment_marker,
+    replacement_text=None,
+):  # pylint: disable=too-many-arguments,too-many-positional-arguments,line-too-long
+    """Returns a review comment for the given lines, with a code suggestion if specified"""
+    result = {
+        "path": file_path,
+        "line": end_line_num,
+        "side": "RIGHT",
+        "body": f"{single_comment_marker} {diagnostic_name_visual(name)} {single_comment_marker}\n"
+        + markdown(message),
+    }
+
+    if start_line_num != end_line_num:
+        result["start_line"] = start_line_num
+        result["start_side"] = "RIGHT"
+
+    if replacement_text is not None:
+        # Make sure the code suggestion ends with a newline character
+        if not replacement_text or replacement_text[-1] != "\n":
+            replacement_text += "\n"
+
+        result["body"] += f"\n```suggestion\n{replacement_text}```"
+
+    return result
+
+
+def generate_diagnostic_comments(
+    diag, file_path, source_file, changed_lines, single_comment_marker, log=print
+):  # pylint: disable=too-many-arguments,too-many-positional-arguments
+    """Generator of the review comments of a diagnostic that concern the given file"""
+
+    def validate_warning_applicability(start_line_num, end_line_num):
+        assert end_line_num >= start_line_num
+
+        return changed_lines.contains(start_line_num, end_line_num)
+
+    diag_name = diag["DiagnosticName"]
+    diag_message = diag["DiagnosticMessage"]
+
+    if not diag_message["Replacements"]:
+        line_num = source_file.get_line_by_offset(diag_message["FileOffset"])
+
+        log(f"Processing '{diag_name}' at line {line_num:d} of {file_path}...")
+
+        if validate_warning_applicability(line_num, line_num):
+            yield generate_single_comment(
+                file_path,
+                line_num,
+                line_num,
+                diag_name,
+                diag_message["Message"],
+                single_comment_marker=single_comment_marker,
+            )
+        else:
+            log("This warning does not apply to the lines changed in this PR")
+        return
+
+    for (
         start_line_num,
         end_line_num,
-        name,
-        message,
-        single_comment_marker,
-        replacement_text=None,
-    ):  # pylint: disable=too-many-arguments,too-many-positional-arguments,line-too-long
-        result = {
-            "path": file_path,
-            "line": end_line_num,
-            "side": "RIGHT",
-            "body": f"{single_comment_marker} {diagnostic_name_visual(name)} {single_comment_marker}\n"
-            + markdown(message),
-        }
+        replacement_text,
+    ) in calculate_replacements_line_spans(
+        source_file,
+        [
+            item
+            for item in diag_message["Replacements"]
+            if item["FilePath"] == file_path
+        ],
+    ):
+        log(
+            # pylint: disable=line-too-long
+            f"Processing '{diag_name}' at lines {start_line_num:d}-{end_line_num:d} of {file_path}..."
+        )
 
-        if start_line_num != end_line_num:
-            result["start_line"] = start_line_num
-            result["start_side"] = "RIGHT"
+        if validate_warning_applicability(start_line_num, end_line_num):
+            yield generate_single_comment(
+                file_path,
+                start_line_num,
+                end_line_num,
+                diag_name,
+                diag_message["Message"],
+                single_comment_marker=single_comment_marker,
+                replacement_text=replacement_text,
+            )
+        else:
+            log("This warning does not apply to the lines changed in this PR")
 
-        if replacement_text is not None:
-            # Make sure the code suggestion ends with a newline character
-            if not replacement_text or replacement_text[-1] != "\n":
-                replacement_text += "\n"
 
-            result["body"] += f"\n```suggestion\n{replacement_text}```"
+def generate_file_review_comments(
+    file_path, work_items, repository_root, changed_lines
+):
+    """Generates the review comments of all the diagnostics concerning a single file
 
-        return result
+    Runs in a worker process, which reads the file only once. Returns the index, the comments
+    and the log messages of every work item, so that the caller can merge them in order.
+    """
+    source_file = SourceFileStore(repository_root).get(file_path)
+    results = []
+    for index, diag, single_comment_marker in work_items:
+        messages = []
+        comments = list(
+            generate_diagnostic_comments(
+                diag,
+                file_path,
+                source_file,
+                changed_lines,
+                single_comment_marker,
+                log=messages.append,
+            )
+        )
+        results.append((index, comments, messages))
+
+    return results
+
+
+def generate_review_comments(
+    diagnostics,
+    repository_root,
+    diff_line_ranges_per_file,
+    single_comment_markers,
+    source_files=None,
+    jobs=1,
+    run_cache=None,
+):  # pylint: disable=too-many-locals,too-many-branches,too-many-statements,too-many-arguments,too-many-positional-arguments
+    """Generator of the Clang-Tidy review comments
+
+    Every diagnostic is split into work items, one per file it concerns. If more than one job
+    is allowed, the work items are grouped by file and each group is processed in a worker
+    process. The comments are yielded in the order of the diagnostics either way, as soon as
+    the file of the next diagnostic has been processed. If a run cache is given, the work items
+    already processed for the same file content are skipped.
+    """
+
+    if source_files is None:
+        source_files = SourceFileStore(repository_root)
 
-    for diag in clang_tidy_fixes[  # pylint: disable=too-many-nested-blocks
-        "Diagnostics"
-    ]:
+    # Either messages about diagnostics that do not apply or (diag, file, marker) work items
+    work_items = []
+
+    for diag in diagnostics:
         # If we have a Clang-Tidy 8 format, then upconvert it to the Clang-Tidy 9+
         if "DiagnosticMessage" not in diag:
             diag["DiagnosticMessage"] = {
@@ -245,364 +1822,501 @@ def generate_review_comments(
         diag_message = diag["DiagnosticMessage"]
 
         # Normalize paths
-        diag_message["FilePath"] = posixpath.normpath(
-            diag_message["FilePath"].replace(repository_root, "")
+        diag_message["FilePath"] = normalize_path(
+            diag_message["FilePath"], repository_root
         )
         for replacement in diag_message["Replacements"]:
-            replacement["FilePath"] = posixpath.normpath(
-                replacement["FilePath"].replace(repository_root, "")
+            replacement["FilePath"] = normalize_path(
+                replacement["FilePath"], repository_root
             )
 
-        diag_name = diag["DiagnosticName"]
-        diag_message_msg = diag_message["Message"]
+        single_comment_marker = single_comment_markers.get(
+            diag["Level"], single_comment_markers["fallback"]
+        )
 
-        if diag["Level"] in single_comment_markers:
-            single_comment_marker = single_comment_markers[diag["Level"]]
+        if diag_message["Replacements"]:
+            # The files are visited in the order they are first referenced
+            file_paths = dict.fromkeys(
+                item["FilePath"] for item in diag_message["Replacements"]
+            )
         else:
-            single_comment_marker = single_comment_markers["fallback"]
+            file_paths = [diag_message["FilePath"]]
 
-        if not diag_message["Replacements"]:
-            file_path = diag_message["FilePath"]
-            offset = diag_message["FileOffset"]
+        for file_path in file_paths:
+            if diff_line_ranges_per_file.get(file_path):
+                work_items.append((diag, file_path, single_comment_marker))
+            else:
+                work_items.append(
+                    f"'{diag['DiagnosticName']}' for {file_path} does not apply to the"
+                    " files changed in this PR"
+                )
 
-            if file_path not in diff_line_ranges_per_file:
-                print(
-                    f"'{diag_name}' for {file_path} does not apply to the files changed in this PR"
+    # The comments of the diagnostics whose file has not changed since a previous run are reused
+    results = {}
+    comments_keys = {}
+    if run_cache is not None:
+        for index, work_item in enumerate(work_items):
+            if not isinstance(work_item, str):
+                diag, file_path, single_comment_marker = work_item
+                comments_keys[index] = run_cache.get_comments_key(
+                    diag,
+                    file_path,
+                    single_comment_marker,
+                    diff_line_ranges_per_file[file_path],
+                )
+                comments = run_cache.get_comments(comments_keys[index])
+                if comments is not None:
+                    results[index] = (comments, [])
+
+        print(f"{len(results):d} diagnostic(s) reused from the run cache")
+
+    work_items_per_file = collections.defaultdict(list)
+    for index, work_item in enumerate(work_items):
+        if not isinstance(work_item, str) and index not in results:
+            diag, file_path, single_comment_marker = work_item
+            work_items_per_file[file_path].append((index, diag, single_comment_marker))
+
+    with contextlib.ExitStack() as stack:
+        # The files are submitted in the order they are first referenced, and the results of
+        # a file are only waited for when its first diagnostic is reached, so that the comments
+        # are yielded as soon as possible
+        futures = {}
+        if jobs > 1 and len(work_items_per_file) > 1:
+            executor = stack.enter_context(
+                concurrent.futures.ProcessPoolExecutor(
+                    max_workers=min(jobs, len(work_items_per_file)),
+                    # Forking a process that runs the HTTP threads is unsafe
+                    mp_context=multiprocessing.get_context("spawn"),
                 )
+            )
+            for file_path, file_work_items in work_items_per_file.items():
+                futures[file_path] = executor.submit(
+                    generate_file_review_comments,
+                    file_path,
+                    file_work_items,
+                    repository_root,
+                    diff_line_ranges_per_file[file_path],
+                )
+
+        for index, work_item in enumerate(work_items):
+            if isinstance(work_item, str):
+                print(work_item)
                 continue
 
-            line_num = get_line_by_offset(repository_root, file_path, offset)
+            diag, file_path, single_comment_marker = work_item
+            if index not in results and file_path in futures:
+                for file_index, comments, messages in futures.pop(file_path).result():
+                    results[file_index] = (comments, messages)
+                    if run_cache is not None:
+                        run_cache.set_comments(comments_keys[file_index], comments)
+
+            if index in results:
+                comments, messages = results.pop(index)
+                for message in messages:
+                    print(message)
+            else:
+                comments = list(
+                    generate_diagnostic_comments(
+                        diag,
+                        file_path,
+                        source_files.get(file_path),
+                        diff_line_ranges_per_file[file_path],
+                        single_comment_marker,
+                    )
+                )
+                if run_cache is not None:
+                    run_cache.set_comments(comments_keys[index], comments)
+
+            yield from comments
 
-            print(f"Processing '{diag_name}' at line {line_num:d} of {file_path}...")
 
-            if validate_warning_applicability(
-                diff_line_ranges_per_file, file_path, line_num, line_num
-            ):
-                yield generate_single_comment(
-                    file_path,
-                    line_num,
-                    line_num,
-                    diag_name,
-                    diag_message_msg,
-                    single_comment_marker=single_comment_marker,
-                )
-            else:
-                print("This warning does not apply to the lines changed in this PR")
+def post_review(github_client, repo, pull_request_id, review):
+    """Creating a review, retrying if the request fails
+
+    A failed request may still have created the review, e.g. when GitHub responds with a bad
+    gateway error or the response times out. The existing reviews are checked for the body of the
+    review before every retry, so that it is never created twice.
+    """
+
+    reviews_url = f"/repos/{repo}/pulls/{pull_request_id:d}/reviews"
+
+    for attempt in range(1, github_client.max_attempts + 1):
+        try:
+            result = github_client.request(
+                "POST", reviews_url, mutating=True, json=review
+            )
+        except (
+            requests.exceptions.ConnectionError,
+            requests.exceptions.Timeout,
+        ) as error:
+            if attempt == github_client.max_attempts:
+                raise
+
+            print(f"Posting the review failed ({error})")
         else:
-            diag_message_replacements = diag_message["Replacements"]
+            if result.status_code == requests.codes.ok:  # pylint: disable=no-member
+                return
 
-            for file_path in {item["FilePath"] for item in diag_message_replacements}:
-                if file_path not in diff_line_ranges_per_file:
-                    # pylint: disable=line-too-long
-                    print(
-                        f"'{diag_name}' for {file_path} does not apply to the files changed in this PR"
-                    )
-                    continue
+            assert (
+                result.status_code in github_client.transient_status_codes
+                and attempt < github_client.max_attempts
+            ), f"Unexpected status code: {result.status_code:d}"
 
-                line_num = 1
-                start_line_num = None
-                end_line_num = None
-                replacement_text = None
+            print(f"Posting the review failed with status code {result.status_code:d}")
 
-                for line in calculate_replacements_diff(
-                    repository_root,
-                    file_path,
-                    [
-                        item
-                        for item in diag_message_replacements
-                        if item["FilePath"] == file_path
-                    ],
-                ):
-                    # The comment line in the diff, ignore it
-                    if line.startswith("? "):
-                        continue
-
-                    # A string belonging only to the original version is the beginning or
-                    # continuation of the section of the file that should be replaced
-                    if line.startswith("- "):
-                        if start_line_num is None:
-                            assert end_line_num is None
-
-                            start_line_num = line_num
-                            end_line_num = line_num
-                        else:
-                            assert end_line_num is not None
-
-                            end_line_num = line_num
-
-                        if replacement_text is None:
-                            replacement_text = ""
-
-                        line_num += 1
-                    # A string belonging only to the modified version is part of the
-                    # replacement text
-                    elif line.startswith("+ "):
-                        if replacement_text is None:
-                            replacement_text = line[2:]
-                        else:
-                            replacement_text += line[2:]
-                    # A string belonging to both original and modified versions is the
-                    # end of the section to replace
-                    elif line.startswith("  "):
-                        if replacement_text is not None:
-                            # If there is a replacement text, but there is no information about
-                            # the section to replace, then this is not a replacement, but a pure
-                            # addition of text. Add the current line to the end of the replacement
-                            # text and "replace" it with the replacement text.
-                            if start_line_num is None:
-                                assert end_line_num is None
-
-                                start_line_num = line_num
-                                end_line_num = line_num
-                                replacement_text += line[2:]
-                            else:
-                                assert end_line_num is not None
-
-                            print(
-                                # pylint: disable=line-too-long
-                                f"Processing '{diag_name}' at lines {start_line_num:d}-{end_line_num:d} of {file_path}..."
-                            )
-
-                            if validate_warning_applicability(
-                                diff_line_ranges_per_file,
-                                file_path,
-                                start_line_num,
-                                end_line_num,
-                            ):
-                                yield generate_single_comment(
-                                    file_path,
-                                    start_line_num,
-                                    end_line_num,
-                                    diag_name,
-                                    diag_message_msg,
-                                    single_comment_marker=single_comment_marker,
-                                    replacement_text=replacement_text,
-                                )
-                            else:
-                                print(
-                                    "This warning does not apply to the lines changed in this PR"
-                                )
-
-                            start_line_num = None
-                            end_line_num = None
-                            replacement_text = None
-
-                        line_num += 1
-                    # Unknown prefix, this should not happen
-                    else:
-                        assert False, "Please report this to the repository maintainer"
-
-                # The end of the file is reached, but there is a section to replace
-                if replacement_text is not None:
-                    # Pure addition of text to the end of the file is not currently supported. If
-                    # you have an example of a Clang-Tidy replacement of this kind, please contact
-                    # the repository maintainer.
-                    assert (
-                        start_line_num is not None and end_line_num is not None
-                    ), "Please report this to the repository maintainer"
-
-                    print(
-                        # pylint: disable=line-too-long
-                        f"Processing '{diag_name}' at lines {start_line_num:d}-{end_line_num:d} of {file_path}..."
-                    )
+        if any(
+            existing_review["body"] == review["body"]
+            for existing_review in github_client.get_pages(reviews_url)
+        ):
+            print("The review was created despite the error")
+            return
 
-                    if validate_warning_applicability(
-                        diff_line_ranges_per_file,
-                        file_path,
-                        start_line_num,
-                        end_line_num,
-                    ):
-                        yield generate_single_comment(
-                            file_path,
-                            start_line_num,
-                            end_line_num,
-                            diag_name,
-                            diag_message_msg,
-                            single_comment_marker=single_comment_marker,
-                            replacement_text=replacement_text,
-                        )
-                    else:
-                        print(
-                            "This warning does not apply to the lines changed in this PR"
-                        )
+        print("The review was not created, retrying...")
+        github_client.backoff(attempt)
 
 
 def post_review_comments(
-    github_api_url,
-    github_token,
-    github_api_timeout,
+    github_client,
     repo,
     pull_request_id,
     warning_comment_prefix,
     review_event,
     review_comments,
     suggestions_per_comment,
-):  # pylint: disable=too-many-arguments,too-many-positional-arguments
-    """Sending the Clang-Tidy review comments to GitHub"""
+    streaming=False,
+    commit_id=None,
+):  # pylint: disable=too-many-arguments,too-many-positional-arguments,too-many-locals
+    """Sending the Clang-Tidy review comments to GitHub
+
+    In streaming mode, every review is posted as soon as enough comments have been generated
+    for it. Since the total number of reviews is not known in advance, the reviews are numbered
+    with a running count. If a commit is given, the comments refer to the lines of that commit
+    instead of the latest one of the PR. Returns the number of posted comments.
+    """
 
-    def split_into_chunks(lst, n):
-        # Copied from: https://stackoverflow.com/a/312464
-        """Yield successive n-sized chunks from lst."""
-        for i in range(0, len(lst), n):
-            yield lst[i : i + n]
+    def split_into_chunks(iterable, n):
+        """Yield successive n-sized chunks from iterable."""
+        iterator = iter(iterable)
+        while chunk := list(itertools.islice(iterator, n)):
+            yield chunk
 
     # Split the comments in chunks to avoid overloading the server
     # and getting 502 server errors as a response for large reviews
-    review_comments = list(split_into_chunks(review_comments, suggestions_per_comment))
+    review_comments = split_into_chunks(review_comments, suggestions_per_comment)
+    total_reviews = None
+    if not streaming:
+        review_comments = list(review_comments)
+        total_reviews = len(review_comments)
+
+    # The reviews posted by this run are told apart from the older ones with the same text by
+    # a hidden marker, so that failed requests can be safely retried
+    run_marker = f"<!-- {uuid.uuid4()} -->"
+    posted_comments = 0
+
+    for current_review, comments_chunk in enumerate(review_comments, start=1):
+        review_number = f"{current_review:d}"
+        if total_reviews is not None:
+            review_number += f"/{total_reviews:d}"
+
+        review = {
+            "body": warning_comment_prefix + f" ({review_number})\n\n{run_marker}",
+            "event": review_event,
+            "comments": comments_chunk,
+        }
+        if commit_id is not None:
+            review["commit_id"] = commit_id
 
-    total_reviews = len(review_comments)
-    current_review = 1
+        post_review(github_client, repo, pull_request_id, review)
+        posted_comments += len(comments_chunk)
+
+    return posted_comments
 
-    for comments_chunk in review_comments:
-        warning_comment = (
-            warning_comment_prefix + f" ({current_review:d}/{total_reviews:d})"
-        )
-        current_review += 1
 
-        result = requests.post(
-            f"{github_api_url}/repos/{repo}/pulls/{pull_request_id:d}/reviews",
+def dismiss_change_requests(
+    github_client,
+    repo,
+    pull_request_id,
+    warning_comment_prefix,
+    reviews,
+):
+    """Dismissing stale Clang-Tidy requests for changes"""
+
+    print("Checking if there are any stale requests for changes to dismiss...")
+
+    # Dismiss only our own reviews
+    # this actor here is somehow different from `github-actions[bot]`
+    # which we get through the Rest API
+    reviews_to_dismiss = [
+        review["databaseId"]
+        for review in reviews
+        if review["state"] == "CHANGES_REQUESTED"
+        and warning_comment_prefix in review["body"]
+        and review["author"]
+        and review["author"]["login"] == "github-actions"
+    ]
+
+    for review_id in reviews_to_dismiss:
+        print(f"Dismissing review {review_id:d}")
+
+        result = github_client.request(
+            "PUT",
+            f"/repos/{repo}/pulls/{pull_request_id:d}/reviews/{review_id:d}/dismissals",
+            mutating=True,
             json={
-                "body": warning_comment,
-                "event": review_event,
-                "comments": comments_chunk,
-            },
-            headers={
-                "Accept": "application/vnd.github.v3+json",
-                "Authorization": f"token {github_token}",
+                "message": "No Clang-Tidy warnings found so I assume my comments were addressed",
+                "event": "DISMISS",
             },
-            timeout=github_api_timeout,
         )
 
-        # Ignore bad gateway errors (false negatives?)
-        assert result.status_code in (
-            requests.codes.ok,  # pylint: disable=no-member
-            requests.codes.bad_gateway,  # pylint: disable=no-member
-        ), f"Unexpected status code: {result.status_code:d}"
+        assert result.status_code == requests.codes.ok  # pylint: disable=no-member
 
-        # Avoid triggering abuse detection
-        time.sleep(10)
 
+def summarize_review_comments(warning_comment_prefix, review_comments, max_rows=100):
+    """Returns the body of a review that summarizes the given review comments instead of posting
+    them, with the number of comments per check and file
 
-def dismiss_change_requests(
-    github_api_url,
-    github_token,
-    github_api_timeout,
+    The check of a comment is identified by the first line of its body, which shows its name and
+    level. The most frequent combinations are listed first, up to the given number of rows.
+    """
+    counts = collections.Counter(
+        (review_comment["body"].split("\n", 1)[0], review_comment["path"])
+        for review_comment in review_comments
+    )
+    # The sort is stable, so combinations as frequent stay in the order of priority
+    rows = sorted(counts.items(), key=lambda item: -item[1])
+
+    lines = [
+        warning_comment_prefix
+        + f" ({len(review_comments):d} more warning(s) not posted as comments)",
+        "",
+        "| Check | File | Warnings |",
+        "| --- | --- | ---: |",
+    ]
+    lines.extend(
+        f"| {check} | `{file_path}` | {count:d} |"
+        for (check, file_path), count in rows[:max_rows]
+    )
+    if len(rows) > max_rows:
+        lines.append(
+            f"| ... | {len(rows) - max_rows:d} more check(s) and file(s) |"
+            f" {sum(count for _, count in rows[max_rows:]):d} |"
+        )
+
+    return "\n".join(lines)
+
+
+def post_review_summary(
+    github_client, repo, pull_request_id, review_event, summary, reviews
+):  # pylint: disable=too-many-arguments,too-many-positional-arguments
+    """Posts a review with the given summary, unless it was already posted and not dismissed
+
+    Returns whether the review was posted.
+    """
+    # this actor here is somehow different from `github-actions[bot]`
+    # which we get through the Rest API
+    if any(
+        review["body"].startswith(summary + "\n\n<!-- ")
+        and review["state"] != "DISMISSED"
+        and review["author"]
+        and review["author"]["login"] == "github-actions"
+        for review in reviews
+    ):
+        print("The summary of the remaining warnings has already been posted")
+        return False
+
+    # Like the other reviews, it is told apart from older ones by a hidden marker
+    post_review(
+        github_client,
+        repo,
+        pull_request_id,
+        {"body": f"{summary}\n\n<!-- {uuid.uuid4()} -->", "event": review_event},
+    )
+    return True
+
+
+# The version of the format of the review plans, to be increased on incompatible changes
+REVIEW_PLAN_VERSION = 1
+
+# The fields of the review plans and their types
+REVIEW_PLAN_FIELDS = {
+    "repository": str,
+    "pull_request_id": int,
+    "head_sha": str,
+    "found_diagnostics": bool,
+    "files": dict,
+    "comments": list,
+}
+
+# The fields of the review comments in the review plans and their types
+REVIEW_COMMENT_FIELDS = {
+    "path": str,
+    "line": int,
+    "side": str,
+    "start_line": int,
+    "start_side": str,
+    "body": str,
+}
+
+
+def write_review_plan(
+    plan_path,
     repo,
     pull_request_id,
-    warning_comment_prefix,
+    head_sha,
+    found_diagnostics,
+    review_comments,
+    repository_root,
 ):  # pylint: disable=too-many-arguments,too-many-positional-arguments
-    """Dismissing stale Clang-Tidy requests for changes"""
+    """Writes the review comments to a review plan, to be posted by a later run
 
-    print("Checking if there are any stale requests for changes to dismiss...")
-
-    result = requests.get(
-        f"{github_api_url}/repos/{repo}/pulls/{pull_request_id:d}/reviews",
-        headers={
-            "Accept": "application/vnd.github.v3+json",
-            "Authorization": f"token {github_token}",
+    Along with the comments, the plan holds the commit they were generated for and the git blob
+    SHAs of the files they concern, so that the comments on files that have changed since then
+    can be left out when the plan is applied.
+    """
+    plan = {
+        "version": REVIEW_PLAN_VERSION,
+        "repository": repo,
+        "pull_request_id": pull_request_id,
+        "head_sha": head_sha,
+        "found_diagnostics": found_diagnostics,
+        "files": {
+            file_path: get_git_blob_sha(repository_root + file_path)
+            for file_path in dict.fromkeys(
+                review_comment["path"] for review_comment in review_comments
+            )
         },
-        timeout=github_api_timeout,
-    )
+        "comments": review_comments,
+    }
+
+    with open(plan_path, "w", encoding="utf_8") as file:
+        json.dump(plan, file, separators=(",", ":"))
+
+    print(f"Wrote {len(review_comments):d} review comment(s) to {plan_path}")
+
+
+def read_review_plan(plan_path, repo, pull_request_id):
+    """Returns the review plan written for the given pull request
+
+    The plan is usually written by a less trusted workflow, so the types of its fields are checked
+    and only the expected fields of the review comments are kept.
+    """
+    with open(plan_path, encoding="utf_8") as file:
+        plan = json.load(file)
 
-    assert result.status_code == requests.codes.ok  # pylint: disable=no-member
+    if not isinstance(plan, dict):
+        print("::error::The review plan is not a JSON object")
+        raise RuntimeError("Failed to read the review plan.")
 
-    reviews = json.loads(result.text)
+    if plan.get("version") != REVIEW_PLAN_VERSION:
+        print(f"::error::Unsupported version of the review plan: {plan.get('version')}")
+        raise RuntimeError("Failed to read the review plan.")
+
+    for field, field_type in REVIEW_PLAN_FIELDS.items():
+        if not isinstance(plan.get(field), field_type):
+            print(f"::error::Invalid field '{field}' in the review plan")
+            raise RuntimeError("Failed to read the review plan.")
+
+    if not all(
+        isinstance(file_path, str) and isinstance(blob_sha, str)
+        for file_path, blob_sha in plan["files"].items()
+    ):
+        print("::error::Invalid field 'files' in the review plan")
+        raise RuntimeError("Failed to read the review plan.")
+
+    if plan["repository"] != repo or plan["pull_request_id"] != pull_request_id:
+        print(
+            f"::error::The review plan was written for {plan['repository']}"
+            f"#{plan['pull_request_id']}, not for {repo}#{pull_request_id:d}"
+        )
+        raise RuntimeError("Failed to read the review plan.")
+
+    review_comments = []
+    for comment_idx, review_comment in enumerate(plan["comments"]):
+        if (
+            not isinstance(review_comment, dict)
+            or not all(field in review_comment for field in ("path", "line", "body"))
+            or any(
+                not isinstance(review_comment[field], field_type)
+                for field, field_type in REVIEW_COMMENT_FIELDS.items()
+                if field in review_comment
+            )
+        ):
+            print(
+                f"::error::Invalid review comment #{comment_idx:d} in the review plan"
+            )
+            raise RuntimeError("Failed to read the review plan.")
+
+        review_comments.append(
+            {
+                field: review_comment[field]
+                for field in REVIEW_COMMENT_FIELDS
+                if field in review_comment
+            }
+        )
+    plan["comments"] = review_comments
+
+    return plan
+
+
+def exclude_stale_review_comments(github_client, repo, pull_request_id, plan, head_sha):
+    """Returns the review comments of a review plan that concern files unchanged since it was
+    written, i.e. whose git blob SHA is the same in the latest commit of the PR
+    """
+    if plan["head_sha"] == head_sha:
+        return plan["comments"]
 
-    # Dismiss only our own reviews
-    reviews_to_dismiss = [
-        review["id"]
-        for review in reviews
-        if review["state"] == "CHANGES_REQUESTED"
-        and warning_comment_prefix in review["body"]
-        and review["user"]["login"] == "github-actions[bot]"
+    print(
+        f"The pull request has been updated since the review plan was written for"
+        f" {plan['head_sha']}"
+    )
+    blob_shas = {
+        pr_file["filename"]: pr_file.get("sha")
+        for pr_file in get_pull_request_files(github_client, repo, pull_request_id)
+    }
+    review_comments = [
+        review_comment
+        for review_comment in plan["comments"]
+        # Files missing from the plan or from the PR are considered changed
+        if plan["files"].get(review_comment["path"]) is not None
+        and plan["files"][review_comment["path"]]
+        == blob_shas.get(review_comment["path"])
     ]
 
-    for review_id in reviews_to_dismiss:
-        print(f"Dismissing review {review_id:d}")
-
-        result = requests.put(
-            # pylint: disable=line-too-long
-            f"{github_api_url}/repos/{repo}/pulls/{pull_request_id:d}/reviews/{review_id:d}/dismissals",
-            headers={
-                "Accept": "application/vnd.github.v3+json",
-                "Authorization": f"token {github_token}",
-            },
-            json={
-                "message": "No Clang-Tidy warnings found so I assume my comments were addressed",
-                "event": "DISMISS",
-            },
-            timeout=github_api_timeout,
+    if len(review_comments) < len(plan["comments"]):
+        print(
+            f"{len(plan['comments']) - len(review_comments):d} review comment(s) left out,"
+            " since their files have changed"
         )
 
-        assert result.status_code == requests.codes.ok  # pylint: disable=no-member
+    return review_comments
+
 
-        # Avoid triggering abuse detection
-        time.sleep(10)
+def parse_timestamp(timestamp):
+    """Parse an ISO 8601 timestamp, assuming UTC if no timezone is specified"""
+    if not timestamp:
+        return None
+
+    parsed = datetime.datetime.fromisoformat(timestamp.replace("Z", "+00:00"))
+    if parsed.tzinfo is None:
+        parsed = parsed.replace(tzinfo=datetime.timezone.utc)
+    return parsed
 
 
 # pylint: disable=too-many-locals, too-many-arguments, too-many-positional-arguments
 def conversation_threads_to_close(
-    repo,
-    pr_number,
-    github_token,
-    github_api_timeout,
+    review_threads,
     single_comment_markers,
     comment_paths=None,
+    since=None,
 ):
     """Generator of unresolved conversation threads to close
 
-    Uses the GitHub GraphQL API to get conversation threads for the given PR.
-    Then filters for unresolved threads and those that have been created by the action.
+    Filters the conversation threads of the PR for unresolved threads and those that have
+    been created by the action, after `since` if specified.
     """
     if comment_paths is None:
         comment_paths = set()
 
-    repo_owner, repo_name = repo.split("/")
-    query = """
-    query {
-      repository(owner: "%s", name: "%s") {
-        pullRequest(number: %d) {
-          id
-          reviewThreads(last: 100) {
-            nodes {
-              id
-              isResolved
-              comments(first: 1) {
-                nodes {
-                  id
-                  body
-                  author {
-                    login
-                  }
-                  path
-                }
-              }
-            }
-          }
-        }
-      }
-    }
-    """ % (
-        repo_owner,
-        repo_name,
-        pr_number,
-    )
-
-    response = requests.post(
-        "https://api.github.com/graphql",
-        json={"query": query},
-        headers={"Authorization": "Bearer " + github_token},
-        timeout=github_api_timeout,
-    )
-
-    if response.status_code != 200:
-        print(
-            f"::error::getting unresolved conversation threads: {response.status_code}"
-        )
-        raise RuntimeError("Failed to get unresolved conversation threads.")
-
-    data = response.json()
-
     # list of regexes that matches comments with repeated marker emojis
     marker_matches = []
     for single_comment_marker in single_comment_markers.values():
@@ -613,12 +2327,14 @@ def conversation_threads_to_close(
         marker_matches.append(comment_matcher)
 
     # Iterate through review threads
-    for thread in data["data"]["repository"]["pullRequest"]["reviewThreads"]["nodes"]:
+    for thread in review_threads:
         if thread["isResolved"]:
             continue
         for comment in thread["comments"]["nodes"]:
+            if since is not None and parse_timestamp(comment["createdAt"]) < since:
+                break
             if (
-                comment["id"]
+                comment["author"]
                 # this actor here is somehow different from `github-actions[bot]`
                 # which we get through the Rest API
                 and comment["author"]["login"] == "github-actions"
@@ -626,34 +2342,32 @@ def conversation_threads_to_close(
                     matcher.match(comment["body"].strip()) for matcher in marker_matches
                 )
                 # if the file does not have any comment, we can safely close any conversation
-                and comment["path"] not in comment_paths
+                and thread["path"] not in comment_paths
             ):
                 yield thread
                 break
 
 
-def close_conversation(thread_id, github_token, github_api_timeout):
-    """Close a conversation thread using the GitHub GraphQL API"""
-    mutation = (
+def close_conversations(github_client, thread_ids):
+    """Close conversation threads using a single GitHub GraphQL API request
+
+    Every thread is resolved by its own aliased mutation, so that a failure to resolve
+    some of the threads does not prevent the others from being resolved.
+    Returns the IDs of the threads that could not be resolved.
+    """
+    mutation = "mutation {%s\n}" % "".join(
         """
-    mutation {
-      resolveReviewThread(input: {threadId: "%s", clientMutationId: "github-actions"}) {
+      t%d: resolveReviewThread(input: {threadId: "%s", clientMutationId: "github-actions"}) {
         thread {
           id
         }
-      }
-    }
-    """
-        % thread_id
+      }"""
+        % (i, thread_id)
+        for i, thread_id in enumerate(thread_ids)
     )
 
-    print(f"::debug::Closing conversation {thread_id}...")
-    response = requests.post(
-        "https://api.github.com/graphql",
-        json={"query": mutation},
-        headers={"Authorization": "Bearer " + github_token},
-        timeout=github_api_timeout,
-    )
+    print(f"::debug::Closing {len(thread_ids):d} conversation(s)...")
+    response = github_client.graphql(mutation, mutating=True)
 
     def _print_error_and_raise(msg):
         print(
@@ -666,56 +2380,531 @@ def close_conversation(thread_id, github_token, github_api_timeout):
     if response.status_code != 200:
         _print_error_and_raise(f"GraphQL request failed: {response.status_code}")
 
-    if "errors" in response.json():
-        error_msg = response.json()["errors"][0]["message"]
-        _print_error_and_raise(
-            "Closing conversations requires `contents: write` permission."
-            if "Resource not accessible by integration" in error_msg
-            else f"Closing conversation query failed: {error_msg}"
+    result = response.json()
+    data = result.get("data") or {}
+    errors_per_alias = {
+        error["path"][0]: error["message"]
+        for error in result.get("errors", [])
+        if error.get("path")
+    }
+    failed_thread_ids = []
+    for i, thread_id in enumerate(thread_ids):
+        alias = f"t{i:d}"
+        if (data.get(alias) or {}).get("thread"):
+            print(f"Conversation {thread_id} closed successfully.")
+            continue
+
+        error_msg = errors_per_alias.get(alias) or next(
+            (error["message"] for error in result.get("errors", [])),
+            "no result returned",
         )
-    print("Conversation closed successfully.")
+        if "Resource not accessible by integration" in error_msg:
+            _print_error_and_raise(
+                "Closing conversations requires `contents: write` permission."
+            )
+        print(f"Closing conversation {thread_id} failed: {error_msg}")
+        failed_thread_ids.append(thread_id)
+
+    return failed_thread_ids
 
 
-# pylint: disable=too-many-arguments, too-many-positional-arguments
 def resolve_conversations(
-    github_token,
-    repo,
-    pull_request_id,
-    github_api_timeout,
+    github_client,
+    review_threads,
     single_comment_markers,
     comment_paths=None,
+    batch_size=50,
+    since=None,
 ):
-    """Resolving stale conversations"""
-    for thread in conversation_threads_to_close(
-        repo,
-        pull_request_id,
-        github_token,
-        github_api_timeout,
-        single_comment_markers,
-        comment_paths=comment_paths,
-    ):
-        close_conversation(
-            thread_id=thread["id"],
-            github_token=github_token,
-            github_api_timeout=github_api_timeout,
+    """Resolving stale conversations in batches of aliased mutations"""
+    thread_ids = [
+        thread["id"]
+        for thread in conversation_threads_to_close(
+            review_threads,
+            single_comment_markers,
+            comment_paths=comment_paths,
+            since=since,
         )
+    ]
+
+    for i in range(0, len(thread_ids), batch_size):
+        batch = thread_ids[i : i + batch_size]
+        attempt = 1
+        while batch := close_conversations(github_client, batch):
+            if attempt == github_client.max_attempts:
+                print(
+                    f"::error::Failed to close {len(batch):d} conversation(s). See log for"
+                    " details and "
+                    "https://github.com/platisd/clang-tidy-pr-comments/blob/master/README.md"
+                    " for help"
+                )
+                raise RuntimeError("Failed to close conversation.")
+            github_client.backoff(attempt)
+            attempt += 1
+            print(f"Retrying to close {len(batch):d} conversation(s)...")
+
+
+def parse_check_weights(check_weights):
+    """Parse a comma or newline separated list of check name patterns and their weights, e.g.
+    'bugprone-*=10,readability-*=-5'
+    """
+    result = []
+    for item in re.split("[,\n]", check_weights):
+        item = item.strip()
+        if not item:
+            continue
 
+        pattern, _, weight = item.rpartition("=")
+        try:
+            result.append((pattern.strip(), int(weight)))
+        except ValueError as error:
+            raise argparse.ArgumentTypeError(
+                f"invalid check weight '{item}', expected a pattern=integer pair"
+            ) from error
+        if not pattern.strip():
+            raise argparse.ArgumentTypeError(
+                f"invalid check weight '{item}', the check name pattern is missing"
+            )
+
+    return result
+
+
+def get_check_weight(diagnostic_name, check_weights):
+    """Returns the weight of the first check name pattern that matches, or 0 if none does"""
+    for pattern, weight in check_weights:
+        if fnmatch.fnmatchcase(diagnostic_name, pattern):
+            return weight
+
+    return 0
 
-def reorder_diagnostics(diags):
+
+def reorder_diagnostics(diags, check_weights=()):
     """
     order diagnostics by level: first error, then warning, then remark
+    diagnostics of the same level are ordered by the weight of their check, highest first
     """
-    errors = [d for d in diags if d["Level"] == "Error"]
-    warnings = [d for d in diags if d["Level"] == "Warning"]
-    remarks = [d for d in diags if d["Level"] == "Remark"]
-    others = [d for d in diags if d["Level"] not in {"Error", "Warning", "Remark"}]
+    diags_per_level = {"Error": [], "Warning": [], "Remark": []}
+    others = []
+
+    for diag in diags:
+        diags_per_level.get(diag["Level"], others).append(diag)
 
     if others:
         print(
             "WARNING: some fixes have an unexpected Level (e.g. not Error, Warning, Remark)"
         )
 
-    return errors + warnings + remarks + others
+    if check_weights:
+        # The sort is stable, so the diagnostics of the same weight keep their order
+        for level_diags in (*diags_per_level.values(), others):
+            level_diags.sort(
+                key=lambda diag: -get_check_weight(
+                    diag["DiagnosticName"], check_weights
+                )
+            )
+
+    return (
+        diags_per_level["Error"]
+        + diags_per_level["Warning"]
+        + diags_per_level["Remark"]
+        + others
+    )
+
+
+def filter_diagnostics_by_files(diags, file_paths, repository_root, log=print):
+    """Generator of the diagnostics that refer to any of the given files
+
+    The check is done before any other processing of the diagnostics, since the reports usually
+    cover far more files than the ones changed in the processed PR.
+    """
+    kept_diags = 0
+    dropped_diags = 0
+
+    for diag in diags:
+        # Clang-Tidy 8 keeps the message details at the top level of the diagnostic
+        diag_message = diag.get("DiagnosticMessage", diag)
+
+        # Diagnostics with replacements are commented only on the files they replace code in
+        if diag_message["Replacements"]:
+            diag_file_paths = (
+                item["FilePath"] for item in diag_message["Replacements"]
+            )
+        else:
+            diag_file_paths = (diag_message["FilePath"],)
+
+        if any(
+            normalize_path(file_path, repository_root) in file_paths
+            for file_path in diag_file_paths
+        ):
+            kept_diags += 1
+            yield diag
+        else:
+            dropped_diags += 1
+
+    log(
+        f"{kept_diags:d} diagnostic(s) apply to the files changed in this PR,"
+        f" {dropped_diags:d} diagnostic(s) for other files skipped"
+    )
+
+
+def deduplicate_diagnostics(diags, repository_root, log=print):
+    """Generator of the diagnostics without the copies reported by multiple translation units
+
+    Diagnostics in headers are reported once for every analyzed source file that includes them.
+    The copies are dropped before any other processing, since they would result in the very
+    same comments.
+    """
+    seen_diags = set()
+    duplicate_diags = 0
+
+    for diag in diags:
+        # Clang-Tidy 8 keeps the message details at the top level of the diagnostic
+        diag_message = diag.get("DiagnosticMessage", diag)
+
+        key = (
+            diag["DiagnosticName"],
+            normalize_path(diag_message["FilePath"], repository_root),
+            diag_message["FileOffset"],
+            frozenset(
+                (
+                    normalize_path(item["FilePath"], repository_root),
+                    item["Offset"],
+                    item["Length"],
+                    item["ReplacementText"],
+                )
+                for item in diag_message["Replacements"]
+            ),
+        )
+
+        if key in seen_diags:
+            duplicate_diags += 1
+            continue
+
+        seen_diags.add(key)
+        yield diag
+
+    log(f"{duplicate_diags:d} duplicate diagnostic(s) collapsed")
+
+
+def process_pull_request(
+    args, metrics
+):  # pylint: disable=too-many-statements,too-many-branches
+    """Posts the review comments of the Clang-Tidy diagnostics to the pull request, as given by
+    the command line arguments, and records the metrics of every phase
+    """
+
+    # The GitHub API token is sensitive information, pass it through the environment
+    github_token = os.environ.get("INPUT_GITHUB_TOKEN")
+
+    github_client = GitHubClient(
+        api_url=os.environ.get("GITHUB_API_URL"),
+        graphql_url=os.environ.get(
+            "GITHUB_GRAPHQL_URL", "https://api.github.com/graphql"
+        ),
+        token=github_token,
+        timeout=10,
+        http_cache_dir=os.path.join(args.cache_dir, "http") if args.cache_dir else None,
+        metrics=metrics,
+    )
+
+    warning_comment_prefix = (
+        ":warning: `Clang-Tidy` found issue(s) with the introduced code"
+    )
+    single_comment_markers = {
+        "Error": ":x:",
+        "Warning": ":warning:",
+        "Remark": ":speech_balloon:",
+        "fallback": ":grey_question:",
+    }
+
+    run_cache = None
+    if args.cache_dir:
+        run_cache = RunCache(
+            args.cache_dir,
+            args.repository,
+            args.pull_request_id,
+            args.repository_root + "/",
+        )
+
+    def get_pull_request_diff_line_ranges_per_file():
+        # Without the metadata of the PR, its base and head commits are not known
+        if run_cache is None or pull_request_snapshot_future is None:
+            return get_diff_line_ranges_per_file(
+                get_pull_request_files(
+                    github_client,
+                    args.repository,
+                    args.pull_request_id,
+                )
+            )
+
+        # The lines changed by the PR depend only on its base and head commits
+        pull_request_snapshot = pull_request_snapshot_future.result()
+        key = f"{pull_request_snapshot.base_sha}...{pull_request_snapshot.head_sha}"
+        diff_line_ranges_per_file = run_cache.get_diff_line_ranges_per_file(key)
+        if diff_line_ranges_per_file is not None:
+            print("The lines changed by the PR were found in the run cache")
+            return diff_line_ranges_per_file
+
+        diff_line_ranges_per_file = get_diff_line_ranges_per_file(
+            get_pull_request_files(
+                github_client,
+                args.repository,
+                args.pull_request_id,
+            )
+        )
+        run_cache.set_diff_line_ranges_per_file(key, diff_line_ranges_per_file)
+        return diff_line_ranges_per_file
+
+    with concurrent.futures.ThreadPoolExecutor(max_workers=2) as executor:
+        # Download the metadata of the PR in the background, while the fixes are being processed.
+        # It is not needed to write a review plan, which can then be done without a token.
+        pull_request_snapshot_future = None
+        if args.mode != "plan":
+            pull_request_snapshot_future = executor.submit(
+                metrics.run_phase,
+                "fetch_pull_request",
+                PullRequestSnapshot,
+                github_client,
+                args.repository,
+                args.pull_request_id,
+            )
+
+        if args.mode == "apply":
+            with metrics.phase("read_plan"):
+                plan = read_review_plan(
+                    args.plan_file, args.repository, args.pull_request_id
+                )
+            found_diagnostics = plan["found_diagnostics"]
+        else:
+            if args.diff_base:
+                diff_line_ranges_per_file_future = executor.submit(
+                    metrics.run_phase,
+                    "changed_lines",
+                    get_diff_line_ranges_from_git,
+                    args.repository_root,
+                    args.diff_base,
+                )
+            else:
+                diff_line_ranges_per_file_future = executor.submit(
+                    metrics.run_phase,
+                    "changed_lines",
+                    get_pull_request_diff_line_ranges_per_file,
+                )
+
+            clang_tidy_fixes_paths = find_clang_tidy_fixes_files(args.clang_tidy_fixes)
+            if not clang_tidy_fixes_paths:
+                print(
+                    f"Could not find the clang-tidy fixes file '{args.clang_tidy_fixes}',"
+                    " it is assumed that it was not generated"
+                )
+
+            if len(clang_tidy_fixes_paths) > 1:
+                # Every file is filtered by the worker parsing it, so the changed files are needed
+                diff_line_ranges_per_file = diff_line_ranges_per_file_future.result()
+                with metrics.phase("read_diagnostics"):
+                    diag_count, clang_tidy_diagnostics = read_clang_tidy_fixes_files(
+                        clang_tidy_fixes_paths,
+                        {
+                            file_path
+                            for file_path, changed_lines in diff_line_ranges_per_file.items()
+                            if changed_lines
+                        },
+                        args.repository_root + "/",
+                        jobs=args.jobs,
+                    )
+            else:
+                with metrics.phase("read_diagnostics"):
+                    clang_tidy_diagnostics = itertools.chain.from_iterable(
+                        map(read_clang_tidy_diagnostics, clang_tidy_fixes_paths)
+                    )
+                    first_diagnostic = next(clang_tidy_diagnostics, None)
+                    diag_count = int(first_diagnostic is not None)
+
+            found_diagnostics = diag_count > 0
+
+        if not found_diagnostics:
+            print("No warnings found by Clang-Tidy")
+            if args.mode != "apply":
+                diff_line_ranges_per_file_future.cancel()
+            if args.mode == "plan":
+                write_review_plan(
+                    args.plan_file,
+                    args.repository,
+                    args.pull_request_id,
+                    args.head_sha or get_head_sha(args.repository_root),
+                    False,
+                    [],
+                    args.repository_root + "/",
+                )
+                return 0
+            pull_request_snapshot = pull_request_snapshot_future.result()
+            with metrics.phase("dismiss_reviews"):
+                dismiss_change_requests(
+                    github_client,
+                    args.repository,
+                    args.pull_request_id,
+                    warning_comment_prefix=warning_comment_prefix,
+                    reviews=pull_request_snapshot.reviews,
+                )
+            if args.auto_resolve_conversations == "true":
+                with metrics.phase("resolve_conversations"):
+                    resolve_conversations(
+                        github_client=github_client,
+                        review_threads=pull_request_snapshot.review_threads,
+                        single_comment_markers=single_comment_markers,
+                        batch_size=args.resolve_batch_size,
+                        since=args.resolve_conversations_since,
+                    )
+            if run_cache is not None:
+                run_cache.save()
+            return 0
+
+        commit_id = None
+        if args.mode == "apply":
+            pull_request_snapshot = pull_request_snapshot_future.result()
+            review_comments = exclude_stale_review_comments(
+                github_client,
+                args.repository,
+                args.pull_request_id,
+                plan,
+                pull_request_snapshot.head_sha,
+            )
+            # The lines of the comments are those of the commit that was analyzed
+            commit_id = plan["head_sha"]
+            streaming = False
+        else:
+            diff_line_ranges_per_file = diff_line_ranges_per_file_future.result()
+
+            with metrics.phase("read_diagnostics"):
+                if len(clang_tidy_fixes_paths) == 1:
+                    clang_tidy_diagnostics = filter_diagnostics_by_files(
+                        itertools.chain([first_diagnostic], clang_tidy_diagnostics),
+                        {
+                            file_path
+                            for file_path, changed_lines in diff_line_ranges_per_file.items()
+                            if changed_lines
+                        },
+                        args.repository_root + "/",
+                    )
+
+                # The single fixes file is parsed lazily, i.e. while this runs
+                diagnostics = reorder_diagnostics(
+                    deduplicate_diagnostics(
+                        clang_tidy_diagnostics, args.repository_root + "/"
+                    ),
+                    check_weights=args.check_weights,
+                )
+
+            review_comments = generate_review_comments(
+                diagnostics,
+                args.repository_root + "/",
+                diff_line_ranges_per_file,
+                single_comment_markers=single_comment_markers,
+                source_files=SourceFileStore(args.repository_root + "/"),
+                jobs=args.jobs,
+                run_cache=run_cache,
+            )
+            # Only a full run posts the reviews while their comments are being generated
+            streaming = args.stream_reviews == "true" and args.mode == "full"
+            if not streaming:
+                with metrics.phase("generate_comments", profile=True):
+                    review_comments = list(review_comments)
+
+            if args.mode == "plan":
+                with metrics.phase("write_plan"):
+                    write_review_plan(
+                        args.plan_file,
+                        args.repository,
+                        args.pull_request_id,
+                        args.head_sha or get_head_sha(args.repository_root),
+                        True,
+                        review_comments,
+                        args.repository_root + "/",
+                    )
+                if run_cache is not None:
+                    run_cache.save()
+                return 0
+
+        pull_request_snapshot = pull_request_snapshot_future.result()
+        posted_comment_keys = pull_request_snapshot.posted_comment_keys()
+        comment_paths = set()
+        if args.mode == "apply":
+            # The conversations about the files left out of the plan may not have been resolved
+            comment_paths.update(plan["files"])
+        remaining_review_comments = []
+
+        def exclude_posted_comments(review_comments):
+            for comment_idx, review_comment in enumerate(review_comments):
+                comment_paths.add(review_comment["path"])
+                key = review_comment_key(review_comment)
+                if key in posted_comment_keys:
+                    continue
+                # The comments come in the order of priority, and only the first ones are
+                # posted, whether by this or by earlier runs. The others are summarized.
+                if 0 < args.max_comments <= comment_idx:
+                    remaining_review_comments.append(review_comment)
+                else:
+                    yield review_comment
+
+        new_review_comments = exclude_posted_comments(review_comments)
+        if not streaming:
+            new_review_comments = list(new_review_comments)
+            if new_review_comments:
+                print(f"Clang-Tidy found {len(new_review_comments):d} new warning(s)")
+
+        # When streaming, the review comments are generated while the reviews are posted
+        with metrics.phase(
+            "generate_and_post_reviews" if streaming else "post_reviews",
+            profile=streaming,
+        ):
+            posted_comments = post_review_comments(
+                github_client,
+                args.repository,
+                args.pull_request_id,
+                warning_comment_prefix,
+                "REQUEST_CHANGES" if args.request_changes == "true" else "COMMENT",
+                new_review_comments,
+                args.suggestions_per_comment,
+                streaming=streaming,
+                commit_id=commit_id,
+            )
+
+            if remaining_review_comments:
+                print(
+                    f"{len(remaining_review_comments):d} new warning(s) beyond the limit of"
+                    f" {args.max_comments:d} comment(s) are summarized in a single review"
+                )
+                post_review_summary(
+                    github_client,
+                    args.repository,
+                    args.pull_request_id,
+                    "REQUEST_CHANGES" if args.request_changes == "true" else "COMMENT",
+                    summarize_review_comments(
+                        warning_comment_prefix, remaining_review_comments
+                    ),
+                    pull_request_snapshot.reviews,
+                )
+
+        if args.auto_resolve_conversations == "true":
+            with metrics.phase("resolve_conversations"):
+                resolve_conversations(
+                    github_client=github_client,
+                    review_threads=pull_request_snapshot.review_threads,
+                    single_comment_markers=single_comment_markers,
+                    comment_paths=comment_paths,
+                    batch_size=args.resolve_batch_size,
+                    since=args.resolve_conversations_since,
+                )
+
+        if not posted_comments and not remaining_review_comments:
+            print("No new warnings found by Clang-Tidy")
+        elif streaming and posted_comments:
+            print(f"Clang-Tidy found {posted_comments:d} new warning(s)")
+
+        if run_cache is not None:
+            run_cache.save()
+
+        return 0
 
 
 def main():
@@ -728,7 +2917,8 @@ def main():
         "--clang-tidy-fixes",
         type=str,
         required=True,
-        help="Path to the Clang-Tidy fixes YAML",
+        help="Path to the Clang-Tidy fixes YAML, or a directory or a glob pattern of"
+        " many fixes files to merge",
     )
     parser.add_argument(
         "--pull-request-id",
@@ -766,139 +2956,123 @@ def main():
         required=True,
         help="If 'true', then close any discussions opened by the Action",
     )
-
-    args = parser.parse_args()
-
-    # The GitHub API token is sensitive information, pass it through the environment
-    github_token = os.environ.get("INPUT_GITHUB_TOKEN")
-
-    github_api_url = os.environ.get("GITHUB_API_URL")
-    github_api_timeout = 10
-
-    warning_comment_prefix = (
-        ":warning: `Clang-Tidy` found issue(s) with the introduced code"
+    parser.add_argument(
+        "--cache-dir",
+        type=str,
+        default="",
+        help="If set, directory where the results of the runs are cached for the later runs",
     )
-    single_comment_markers = {
-        "Error": ":x:",
-        "Warning": ":warning:",
-        "Remark": ":speech_balloon:",
-        "fallback": ":grey_question:",
-    }
-
-    diff_line_ranges_per_file = get_diff_line_ranges_per_file(
-        get_pull_request_files(
-            github_api_url,
-            github_token,
-            github_api_timeout,
-            args.repository,
-            args.pull_request_id,
-        )
+    parser.add_argument(
+        "--stream-reviews",
+        type=str,
+        default="false",
+        help="If 'true', then post every review as soon as its comments are generated",
     )
-
-    if os.path.isfile(args.clang_tidy_fixes):
-        with open(args.clang_tidy_fixes, encoding="utf_8") as file:
-            clang_tidy_fixes = yaml.safe_load(file)
-    else:
-        print(
-            f"Could not find the clang-tidy fixes file '{args.clang_tidy_fixes}',"
-            " it is assumed that it was not generated"
-        )
-        clang_tidy_fixes = None
-
-    if (
-        clang_tidy_fixes is None
-        or "Diagnostics" not in clang_tidy_fixes
-        or not clang_tidy_fixes["Diagnostics"]
-    ):
-        print("No warnings found by Clang-Tidy")
-        dismiss_change_requests(
-            github_api_url,
-            github_token,
-            github_api_timeout,
-            args.repository,
-            args.pull_request_id,
-            warning_comment_prefix=warning_comment_prefix,
-        )
-        if args.auto_resolve_conversations == "true":
-            resolve_conversations(
-                github_token=github_token,
-                repo=args.repository,
-                pull_request_id=args.pull_request_id,
-                github_api_timeout=github_api_timeout,
-                single_comment_markers=single_comment_markers,
-            )
-        return 0
-
-    clang_tidy_fixes["Diagnostics"] = reorder_diagnostics(
-        clang_tidy_fixes["Diagnostics"]
+    parser.add_argument(
+        "--diff-base",
+        type=str,
+        default="",
+        help="If set, compute the lines changed by the PR with a local git diff against"
+        " the merge base with this revision, instead of using the GitHub API",
     )
-
-    review_comments = list(
-        generate_review_comments(
-            clang_tidy_fixes,
-            args.repository_root + "/",
-            diff_line_ranges_per_file,
-            single_comment_markers=single_comment_markers,
-        )
-    )
-    if args.auto_resolve_conversations == "true":
-        comment_paths = set(comment["path"] for comment in review_comments)
-        resolve_conversations(
-            github_token=github_token,
-            repo=args.repository,
-            pull_request_id=args.pull_request_id,
-            github_api_timeout=github_api_timeout,
-            single_comment_markers=single_comment_markers,
-            comment_paths=comment_paths,
-        )
-
-    existing_pull_request_comments = list(
-        get_pull_request_comments(
-            github_api_url,
-            github_token,
-            github_api_timeout,
-            args.repository,
-            args.pull_request_id,
-        )
+    parser.add_argument(
+        "--jobs",
+        type=int,
+        default=os.cpu_count() or 1,
+        help="Number of processes generating the review comments",
+    )
+    parser.add_argument(
+        "--resolve-batch-size",
+        type=int,
+        default=50,
+        help="Number of conversations to close per GraphQL request",
+    )
+    parser.add_argument(
+        "--resolve-conversations-since",
+        type=parse_timestamp,
+        default=None,
+        help="Only close the conversations started after this ISO 8601 timestamp",
+    )
+    parser.add_argument(
+        "--max-comments",
+        type=int,
+        default=0,
+        help="Maximum number of review comments about the warnings, the highest priority"
+        " ones are posted and the others are summarized in a single review (0 means no limit)",
+    )
+    parser.add_argument(
+        "--check-weights",
+        type=parse_check_weights,
+        default=[],
+        help="Comma or newline separated check name patterns and their weights, e.g."
+        " 'bugprone-*=10,readability-*=-5'. Within each level, the warnings of the checks"
+        " with the highest weight are commented on first",
+    )
+    parser.add_argument(
+        "--mode",
+        type=str,
+        choices=("full", "plan", "apply"),
+        default="full",
+        help="'full' posts the review comments of the Clang-Tidy diagnostics, 'plan' only"
+        " writes them to the review plan file and 'apply' only posts those of the review plan"
+        " file, without reading any fixes or sources",
+    )
+    parser.add_argument(
+        "--plan-file",
+        type=str,
+        default="",
+        help="Path to the review plan file written in 'plan' mode and read in 'apply' mode",
+    )
+    parser.add_argument(
+        "--head-sha",
+        type=str,
+        default="",
+        help="SHA of the head commit of the PR that was analyzed, recorded in the review plan"
+        " in 'plan' mode (otherwise the commit checked out in the repository root)",
+    )
+    parser.add_argument(
+        "--metrics-file",
+        type=str,
+        default="",
+        help="If set, path of a JSON file to write the timing, GitHub API usage and memory"
+        " metrics of the run to",
+    )
+    parser.add_argument(
+        "--metrics-summary",
+        type=str,
+        default="false",
+        help="If 'true', then add tables of the metrics of the run to the job summary",
+    )
+    parser.add_argument(
+        "--profile-file",
+        type=str,
+        default="",
+        help="If set, path of a file to write the cProfile statistics of the generation of"
+        " the review comments to",
     )
 
-    # Exclude already posted comments
-    for comment in existing_pull_request_comments:
-        review_comments = list(
-            filter(
-                lambda review_comment: not (
-                    review_comment["path"]
-                    == comment["path"]  # pylint: disable=cell-var-from-loop
-                    and review_comment["line"]
-                    == comment["line"]  # pylint: disable=cell-var-from-loop
-                    and review_comment["side"]
-                    == comment["side"]  # pylint: disable=cell-var-from-loop
-                    and review_comment["body"]
-                    == comment["body"]  # pylint: disable=cell-var-from-loop
-                ),
-                review_comments,
-            )
-        )
-
-    if not review_comments:
-        print("No new warnings found by Clang-Tidy")
-        return 0
-
-    print(f"Clang-Tidy found {len(review_comments):d} new warning(s)")
+    args = parser.parse_args()
+    if args.mode != "full" and not args.plan_file:
+        parser.error(f"--plan-file is required in '{args.mode}' mode")
 
-    post_review_comments(
-        github_api_url,
-        github_token,
-        github_api_timeout,
-        args.repository,
-        args.pull_request_id,
-        warning_comment_prefix,
-        "REQUEST_CHANGES" if args.request_changes == "true" else "COMMENT",
-        review_comments,
-        args.suggestions_per_comment,
+    metrics_summary_path = (
+        os.environ.get("GITHUB_STEP_SUMMARY")
+        if args.metrics_summary == "true"
+        else None
+    )
+    metrics = Metrics(
+        trace_memory=bool(args.metrics_file or metrics_summary_path),
+        profile_path=args.profile_file or None,
     )
 
-    return 0
+    # The metrics are reported even if the run fails, since they may tell why
+    try:
+        return process_pull_request(args, metrics)
+    finally:
+        if args.metrics_file:
+            metrics.write_json(args.metrics_file)
+        if metrics_summary_path:
+            metrics.write_summary(metrics_summary_path)
 
 
 if __name__ == "__main__":